@@ -29,27 +29,20 @@ __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
 import sys  # For gracefully notifying whether the script has ended or not
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
 import pandas as pd  # For calculating coefficient of correlation
 import numpy as np  # For getting log values from prices
-import warnings  # For removing Deprecation Warning w.r.t. Yahoo Finance Fix
 import matplotlib.pyplot as plt
 import scipy.stats
+import scipy.special  # For the exact GBM crash probabilities
+import itertools  # For the sets of markets crashing together
 import statsmodels.graphics.gofplots as sm
 import math
+import hashlib  # For keying cached statistics by their input data
+import multiprocessing  # For running the Monte Carlo simulation across processes
 
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
-
-
-def yahoo_finance_bridge():
-    """
-        This function fixes problems w.r.t. fetching data from Yahoo Finance
-        :return: None
-        """
-    logging.info('Correcting Yahoo Finance')
-    pdr_override()
+import os  # For locating the shared market data module
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import market_data  # Shared on-disk cache of the market data, in the root of the repository
 
 
 # Main block of the program. The program begins execution from this block when called from a cmd
@@ -77,31 +70,127 @@ def lognormal_check_markets(dataframe_dictionary):
             print(key + '\'s Price Movements follow a Log-Normal Distribution')
 
 
-def lognormal_check_deviation(data_dict):
+# Results of distribution_statistics, keyed by a hash of the input data
+_distribution_statistics_cache = {}
+
+
+def _skewtest_statistic(skewness, n):
+    """
+    This function calculates the D'Agostino skewness test statistic (as scipy.stats.skewtest) from the sample
+    skewness, for arrays of skewness and sample sizes
+    :return: np.ndarray - The test statistics
+    """
+    y = skewness * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+    beta2 = (3.0 * (n * n + 27 * n - 70) * (n + 1) * (n + 3)) / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+    w2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(w2))
+    alpha = np.sqrt(2.0 / (w2 - 1))
+    y = np.where(y == 0, 1, y)
+    return delta * np.log(y / alpha + np.sqrt((y / alpha) ** 2 + 1))
+
+
+def _kurtosistest_statistic(kurtosis, n):
+    """
+    This function calculates the Anscombe-Glynn kurtosis test statistic (as scipy.stats.kurtosistest) from the
+    sample (Pearson) kurtosis, for arrays of kurtosis and sample sizes
+    :return: np.ndarray - The test statistics
+    """
+    expected = 3.0 * (n - 1) / (n + 1)
+    variance = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.) * (n + 3) * (n + 5))
+    x = (kurtosis - expected) / np.sqrt(variance)
+    sqrt_beta1 = 6.0 * (n * n - 5 * n + 2) / ((n + 7) * (n + 9)) * np.sqrt((6.0 * (n + 3) * (n + 5)) /
+                                                                          (n * (n - 2) * (n - 3)))
+    a = 6.0 + 8.0 / sqrt_beta1 * (2.0 / sqrt_beta1 + np.sqrt(1 + 4.0 / (sqrt_beta1 ** 2)))
+    term1 = 1 - 2 / (9.0 * a)
+    denominator = 1 + x * np.sqrt(2 / (a - 4.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        term2 = np.sign(denominator) * np.where(denominator == 0.0, np.nan,
+                                                np.power((1 - 2.0 / a) / np.abs(denominator), 1 / 3.0))
+    return (term1 - term2) / np.sqrt(2 / (9.0 * a))
+
+
+def distribution_statistics(values):
+    """
+    This function calculates the distribution statistics of every column of a DataFrame in one vectorized pass: the
+    moments, the skewness, kurtosis and one sample t-test statistics, and the order statistics. Columns may have
+    missing values, for example markets with different trading calendars, which are left out of their statistics.
+    Results are cached by a hash of the data, so repeated calls on the same data are free
+    :param values: DataFrame with a column per market
+    :return: pd.DataFrame - A row of statistics per market
+    """
+    key = (tuple(values.columns),
+           hashlib.sha1(pd.util.hash_pandas_object(values, index=True).values).hexdigest())
+    if key in _distribution_statistics_cache:
+        return _distribution_statistics_cache[key].copy()
+
+    data = values.values.astype(float)
+    n = np.count_nonzero(~np.isnan(data), axis=0).astype(float)
+    mean = np.nansum(data, axis=0) / n
+    centred = data - mean
+    m2 = np.nansum(centred ** 2, axis=0) / n
+    m3 = np.nansum(centred ** 3, axis=0) / n
+    m4 = np.nansum(centred ** 4, axis=0) / n
+    std = np.sqrt(m2 * n / (n - 1))
+    skewness = m3 / m2 ** 1.5
+    kurtosis = m4 / m2 ** 2
+
+    # A single sort gives all the order statistics, missing values are sorted to the end of every column
+    ordered = np.sort(data, axis=0)
+    columns = np.arange(data.shape[1])
+    quantiles = []
+    for q in (0.25, 0.5, 0.75):
+        position = q * (n - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, n.astype(int) - 1)
+        fraction = position - lower
+        quantiles.append(ordered[lower, columns] * (1 - fraction) + ordered[upper, columns] * fraction)
+
+    statistics = pd.DataFrame(
+        {'count': n, 'mean': mean, 'std': std, 'min': ordered[0], '25%': quantiles[0], '50%': quantiles[1],
+         '75%': quantiles[2], 'max': ordered[n.astype(int) - 1, columns], 'skewness': skewness,
+         'kurtosis': kurtosis - 3, 'skewtest': _skewtest_statistic(skewness, n),
+         'kurtosistest': _kurtosistest_statistic(kurtosis, n), 't_statistic': mean / (std / np.sqrt(n))},
+        index=values.columns,
+        columns=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max', 'skewness', 'kurtosis', 'skewtest',
+                 'kurtosistest', 't_statistic'])
+    _distribution_statistics_cache[key] = statistics
+    return statistics.copy()
+
+
+def print_distribution_statistics(statistics, measure):
+    """
+    This function prints the distribution statistics of every market
+    :param statistics: The statistics from distribution_statistics
+    :param measure: The name of what the statistics are of, for example 'Prices'
+    :return: None
+    """
+    for key, row in statistics.iterrows():
+        print('\n===== Calculating Statistic for %s for %s =====' % (measure, key))
+        print('Skew for %s is : %f' % (key, row['skewtest']))
+        print('Kurtosis for %s is : %f' % (key, row['kurtosistest']))
+        print('T-Statistic for %s is : %f' % (key, row['t_statistic']))
+        print('Mean for %s is : %f' % (key, row['mean']))
+        print('Median for %s is : %f' % (key, row['50%']))
+        print('Standard Deviation for %s is : %f' % (key, row['std']))
+        print('Min for %s is : %f' % (key, row['min']))
+        print('Max for %s is : %f' % (key, row['max']))
+        print('========================================\n')
+
+
+def lognormal_check_deviation(data_dict, verbose=True):
     """
     This function takes a dictionary containing Markets DataFrame, and does a np.log() on the closing
     prices. Then it gives skewness, kurtosis, mean, median std, min and max of the values
     :param data_dict: The dictionary containing the DataFrames
-    :return: dict
+    :param verbose: Whether to print the statistics
+    :return: pd.DataFrame - The statistics from distribution_statistics
     """
-    # Iterate through every market
-    for key, value in data_dict.items():
-        # Take the log of close prices
-        close_price = np.log(value['Close'])
-        print('\n===== Calculating Statistic for Prices for %s =====' % key)
-        skew = scipy.stats.skewtest(close_price)
-        print('Skew for %s is : %f' % (key, skew.statistic))
-        kurt = scipy.stats.kurtosistest(close_price)
-        print('Kurtosis for %s is : %f' % (key, kurt.statistic))
-        t_test = scipy.stats.ttest_1samp(close_price, 0)
-        print('T-Statistic for %s is : %f' % (key, t_test.statistic))
-        desc = close_price.describe()
-        print('Mean for %s is : %f' % (key, desc.iloc[1]))
-        print('Median for %s is : %f' % (key, desc.iloc[5]))
-        print('Standard Deviation for %s is : %f' % (key, desc.iloc[2]))
-        print('Min for %s is : %f' % (key, desc.iloc[3]))
-        print('Max for %s is : %f' % (key, desc.iloc[7]))
-        print('========================================\n')
+    # Take the log of close prices, aligned by date
+    close_price = np.log(pd.concat(dict((key, value['Close']) for key, value in data_dict.items()), axis=1))
+    statistics = distribution_statistics(close_price)
+    if verbose:
+        print_distribution_statistics(statistics, 'Prices')
+    return statistics
 
 
 def normal_check_market_returns(data_dict):
@@ -127,31 +216,21 @@ def normal_check_market_returns(data_dict):
             print(key + '\'s Stock Returns follow a Normal Distribution')
 
 
-def normal_check_deviation(data_dict):
+def normal_check_deviation(data_dict, verbose=True):
     """
     This function takes a dictionary containing Markets DataFrame, calculates the returns.
     Then it gives skewness, kurtosis, mean, median std, min and max of the values
     :param data_dict: The dictionary containing the DataFrames
-    :return: dict
+    :param verbose: Whether to print the statistics
+    :return: pd.DataFrame - The statistics from distribution_statistics
     """
-    # Iterate through every market
-    for key, value in data_dict.items():
-        # Take the log of close prices
-        daily_return = value['Close'].pct_change().fillna(method='backfill')
-        print('\n===== Calculating Statistic for Stock Returns for %s =====' % key)
-        skew = scipy.stats.skewtest(daily_return)
-        print('Skew for %s is : %f' % (key, skew.statistic))
-        kurt = scipy.stats.kurtosistest(daily_return)
-        print('Kurtosis for %s is : %f' % (key, kurt.statistic))
-        t_test = scipy.stats.ttest_1samp(daily_return, 0)
-        print('T-Statistic for %s is : %f' % (key, t_test.statistic))
-        desc = daily_return.describe()
-        print('Mean for %s is : %f' % (key, desc.iloc[1]))
-        print('Median for %s is : %f' % (key, desc.iloc[5]))
-        print('Standard Deviation for %s is : %f' % (key, desc.iloc[2]))
-        print('Min for %s is : %f' % (key, desc.iloc[3]))
-        print('Max for %s is : %f' % (key, desc.iloc[7]))
-        print('========================================\n')
+    # Daily returns of every market on its own calendar, aligned by date
+    daily_return = pd.concat(dict((key, value['Close'].pct_change().fillna(method='backfill'))
+                                  for key, value in data_dict.items()), axis=1)
+    statistics = distribution_statistics(daily_return)
+    if verbose:
+        print_distribution_statistics(statistics, 'Stock Returns')
+    return statistics
 
 
 def plot_qq_plot(data, both=True):
@@ -229,46 +308,546 @@ def plot_qq_plot(data, both=True):
     plt.show()
 
 
-def market_crash_probability(snp_data):
+def gbm_crash_parameters(snp_data):
     """
-    This function calculates the probability of a stock market crash using GBM
-    :param sp_data: the snp500 close price data
-    :return: None
+    This function derives the GBM parameters used by the crash simulation from the snp500 close price data.
+    The simulation starts at the final day of the data, so that running GBM gives the next day's forecast
+    :param snp_data: the snp500 close price data
+    :return: dict - log_s0, mu, sigma, dt and steps for the simulation
     """
     # Calculate Yearly Returns
     snp_yearly = snp_data['Close'].pct_change(259).dropna()[0]
-    # start at the final day of the data to be starting point this assumes that when running GBM it will give daily next year forecast
-    snp0 = math.log(snp_data['Close'][-1])
-    m = snp_yearly  # Expected Return
-    sigma = 0.20  # Anuallized Volatility
     T = 1 / 252.0  # Maturity Date in years
     dt = .00001
-    N = 10
-    steps = round(T / dt)  # number of steps
-    snp = np.zeros([int(N), int(steps)], dtype=float)
-    x = range(0, int(steps), 1)
-    storage = []  # For storing simulated values, to calc. probability
-    for j in range(0, N, 1):
-        snp[j, 0] = snp0
-        for i in x[:-1]:
-            snp[j, i + 1] = snp[j, i] + (m - 0.5 * pow(sigma, 2)) * dt + sigma * scipy.sqrt(
-                dt) * np.random.standard_normal()
-        storage.append(np.exp(snp)[j])
-        plt.plot(x, np.exp(snp)[j])
-    plt.xlabel('Steps')
-    plt.ylabel('SnP500 Prices')
-    plt.show()
+    return {'log_s0': math.log(snp_data['Close'][-1]),
+            'mu': snp_yearly,  # Expected Return
+            'sigma': 0.20,  # Anuallized Volatility
+            'dt': dt,
+            'steps': int(round(T / dt))}  # number of steps
 
-    # For calculating probability
-    # Get the returns for each day from simulated set, minus
-    storage = pd.DataFrame(storage)
-    storage_returns = storage.T.pct_change()
-    # Where returns are less than a 20.3% drop, which was a single day crash in 19887
-    prob = storage_returns < -0.203
-    probability_of_crash = prob.sum()
-    for index, row in probability_of_crash.iteritems():
-        print('The probability of a 1987 crash of SnP500, where a single intraday crash was 20.3%, '
-              'using GBM with the ' + str(index) + ' simulation is: ' + str(row))
+
+def simulate_gbm_log_paths(log_s0, mu, sigma, dt, steps, n_paths, seed=None):
+    """
+    This function simulates log price paths of a Geometric Brownian Motion. All the increments are drawn in a
+    single batch and the paths are built with a cumulative sum, instead of stepping through every path in Python
+    :param log_s0: The log of the starting price
+    :param mu: The expected (annual) return
+    :param sigma: The annualized volatility
+    :param dt: The size of a single step, in years
+    :param steps: The number of points in every path, including the starting point
+    :param n_paths: The number of paths to simulate
+    :param seed: Seed for the random number generator, so that a simulation can be reproduced
+    :return: np.ndarray - Array of shape (n_paths, steps) containing the log prices
+    """
+    random_state = np.random.RandomState(seed)
+    increments = random_state.standard_normal((int(n_paths), int(steps) - 1))
+    increments *= sigma * math.sqrt(dt)
+    increments += (mu - 0.5 * pow(sigma, 2)) * dt
+    log_paths = np.empty((int(n_paths), int(steps)), dtype=float)
+    log_paths[:, 0] = log_s0
+    np.cumsum(increments, axis=1, out=log_paths[:, 1:])
+    log_paths[:, 1:] += log_s0
+    return log_paths
+
+
+def gbm_crash_statistics(log_paths, threshold=-0.203):
+    """
+    This function counts the single step crashes in simulated log price paths, that is, the steps where the
+    return is less than the threshold
+    :param log_paths: Array of shape (n_paths, steps) containing the log prices
+    :param threshold: The single step return that counts as a crash, -0.203 for the 1987 crash
+    :return: dict - crash counts per path, the number of paths with a crash and the crash probabilities
+    """
+    # Simple returns of every step, computed from the log prices without building the price paths
+    step_returns = np.expm1(np.diff(log_paths, axis=1))
+    crash_counts = np.count_nonzero(step_returns < threshold, axis=1)
+    paths_with_crash = int(np.count_nonzero(crash_counts))
+    return {'crash_counts': crash_counts,
+            'paths_with_crash': paths_with_crash,
+            'path_probability': paths_with_crash / float(len(crash_counts)),
+            'step_probability': crash_counts.sum() / float(step_returns.size),
+            'n_samples': step_returns.size,
+            'min_return': step_returns.min()}
+
+
+def _chunk_seeds(seed, n_paths, chunk_size):
+    """
+    This function splits the paths of a simulation into chunks, and gives every chunk its own random stream keyed
+    by the seed and the position of the chunk, so that the result does not depend on how the chunks are processed
+    :param seed: Seed of the simulation, a random one is drawn if None
+    :param n_paths: The number of paths to simulate
+    :param chunk_size: The maximum number of paths in a chunk
+    :return: list - (chunk paths, chunk seed) tuples
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2 ** 31 - 1)
+    n_paths = int(n_paths)
+    chunk_size = int(chunk_size)
+    return [(min(chunk_size, n_paths - start), [seed, index])
+            for index, start in enumerate(range(0, n_paths, chunk_size))]
+
+
+def _terminal_bin_edges(log_s0, mu, sigma, dt, steps, bins):
+    """
+    This function returns fixed histogram bin edges for the terminal log price, spanning 10 standard deviations
+    either side of its expected value
+    :return: np.ndarray - The bin edges
+    """
+    horizon = (int(steps) - 1) * dt
+    centre = log_s0 + (mu - 0.5 * pow(sigma, 2)) * horizon
+    spread = 10 * sigma * math.sqrt(horizon)
+    return np.linspace(centre - spread, centre + spread, int(bins) + 1)
+
+
+def _simulate_crash_chunk(log_s0, mu, sigma, dt, steps, n_paths, seed, threshold, bin_edges):
+    """
+    This function simulates a single chunk of paths, and reduces it to the running statistics of the simulation
+    :return: dict - The statistics of the chunk
+    """
+    log_paths = simulate_gbm_log_paths(log_s0, mu, sigma, dt, steps, n_paths, seed=seed)
+    statistics = gbm_crash_statistics(log_paths, threshold=threshold)
+    terminal = np.clip(log_paths[:, -1], bin_edges[0], bin_edges[-1])
+    return {'n_paths': n_paths,
+            'paths_with_crash': statistics['paths_with_crash'],
+            'crash_steps': int(statistics['crash_counts'].sum()),
+            'min_return': statistics['min_return'],
+            'terminal_sum': np.exp(log_paths[:, -1]).sum(),
+            'terminal_histogram': np.histogram(terminal, bins=bin_edges)[0]}
+
+
+def _simulate_crash_chunk_task(arguments):
+    """
+    This function unpacks the arguments of _simulate_crash_chunk, so that it can be mapped over a process pool
+    :param arguments: The arguments of _simulate_crash_chunk as a tuple
+    :return: dict - The statistics of the chunk
+    """
+    return _simulate_crash_chunk(*arguments)
+
+
+def _merge_crash_statistics(running, chunk):
+    """
+    This function adds the statistics of a chunk to the running statistics of the simulation
+    :param running: The running statistics, or None for the first chunk
+    :param chunk: The statistics of the chunk
+    :return: dict - The updated running statistics
+    """
+    if running is None:
+        return chunk
+    running['n_paths'] += chunk['n_paths']
+    running['paths_with_crash'] += chunk['paths_with_crash']
+    running['crash_steps'] += chunk['crash_steps']
+    running['min_return'] = min(running['min_return'], chunk['min_return'])
+    running['terminal_sum'] += chunk['terminal_sum']
+    running['terminal_histogram'] += chunk['terminal_histogram']
+    return running
+
+
+def _histogram_quantiles(histogram, bin_edges, quantiles):
+    """
+    This function reads quantiles off a histogram, interpolating linearly within a bin
+    :return: np.ndarray - The quantile values
+    """
+    cumulative = np.concatenate(([0], np.cumsum(histogram))) / float(histogram.sum())
+    # Drop the edges of empty bins, so that the cumulative distribution is strictly increasing
+    keep = np.concatenate(([True], histogram > 0))
+    return np.interp(quantiles, cumulative[keep], bin_edges[keep])
+
+
+def _finalize_crash_statistics(running, steps, bin_edges, quantiles):
+    """
+    This function turns the running statistics of a simulation into the reported crash statistics
+    :return: dict - The crash statistics
+    """
+    n_paths = running['n_paths']
+    terminal_quantiles = np.exp(_histogram_quantiles(running['terminal_histogram'], bin_edges, quantiles))
+    return {'n_paths': n_paths,
+            'paths_with_crash': running['paths_with_crash'],
+            'path_probability': running['paths_with_crash'] / float(n_paths),
+            'crash_steps': running['crash_steps'],
+            'step_probability': running['crash_steps'] / float(n_paths * (int(steps) - 1)),
+            'n_samples': n_paths * (int(steps) - 1),
+            'min_return': running['min_return'],
+            'terminal_mean': running['terminal_sum'] / n_paths,
+            'terminal_quantiles': dict(zip(quantiles, terminal_quantiles))}
+
+
+def stream_gbm_crash_statistics(log_s0, mu, sigma, dt, steps, n_paths, chunk_size=10000, threshold=-0.203,
+                                seed=None, quantiles=(0.01, 0.05, 0.5, 0.95, 0.99), bins=4096, n_workers=1):
+    """
+    This function runs the GBM crash simulation in chunks of paths, and only keeps running statistics of the
+    simulated paths, so that the memory used stays the same however many paths are requested. The terminal
+    price quantiles are read off a fixed histogram of the terminal log price. Every chunk has its own random stream,
+    so the chunks can be simulated in parallel worker processes and the result only depends on the seed
+    :param log_s0: The log of the starting price
+    :param mu: The expected (annual) return
+    :param sigma: The annualized volatility
+    :param dt: The size of a single step, in years
+    :param steps: The number of points in every path, including the starting point
+    :param n_paths: The number of paths to simulate
+    :param chunk_size: The maximum number of paths held in memory at a time
+    :param threshold: The single step return that counts as a crash
+    :param seed: Seed for the random number generator, so that a simulation can be reproduced
+    :param quantiles: The terminal price quantiles to report
+    :param bins: The number of bins of the terminal log price histogram
+    :param n_workers: The number of processes the chunks are spread across
+    :return: dict - The crash counts, crash probabilities, minimum single step return and terminal prices
+    """
+    bin_edges = _terminal_bin_edges(log_s0, mu, sigma, dt, steps, bins)
+    tasks = [(log_s0, mu, sigma, dt, steps, chunk_paths, chunk_seed, threshold, bin_edges)
+             for chunk_paths, chunk_seed in _chunk_seeds(seed, n_paths, chunk_size)]
+    pool = multiprocessing.Pool(n_workers) if n_workers > 1 else None
+    try:
+        # The chunks are merged in their original order, so the result is the same for any number of workers
+        if pool:
+            chunks = pool.imap(_simulate_crash_chunk_task, tasks)
+        else:
+            chunks = (_simulate_crash_chunk_task(task) for task in tasks)
+        running = None
+        for chunk in chunks:
+            running = _merge_crash_statistics(running, chunk)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return _finalize_crash_statistics(running, steps, bin_edges, quantiles)
+
+
+def _crash_estimator_samples(method, shocks, crash_level, drift, diffusion, shift):
+    """
+    This function turns standard normal shocks into the samples of a crash probability estimator, along with the
+    control variate of every sample
+    :param method: One of 'plain', 'antithetic', 'control_variate' or 'importance'
+    :param shocks: Standard normal draws, one per simulated step
+    :param crash_level: The shock below which a step is a crash
+    :param drift: The drift of a single log return step
+    :param diffusion: The standard deviation of a single log return step
+    :param shift: The mean the shocks are shifted to for importance sampling
+    :return: tuple - The estimator samples (scaled by exp(shift ** 2 / 2) for importance sampling), and the centred
+    control variate (None if unused)
+    """
+    if method == 'plain':
+        return (shocks < crash_level).astype(float), None
+    elif method == 'antithetic':
+        return 0.5 * ((shocks < crash_level).astype(float) + (-shocks < crash_level)), None
+    elif method == 'control_variate':
+        # The simple return of the step, whose expected value is known exactly under GBM
+        control = np.expm1(drift + diffusion * shocks) - math.expm1(drift + 0.5 * pow(diffusion, 2))
+        return (shocks < crash_level).astype(float), control
+    elif method == 'importance':
+        # Draw the shocks around the shift, and weight them with the likelihood ratio of the standard normal. The
+        # constant factor exp(-shift ** 2 / 2) of the likelihood ratio is left out, as it underflows in the far tail
+        crashed = shocks + shift < crash_level
+        samples = np.zeros(shocks.shape)
+        samples[crashed] = np.exp(-shift * shocks[crashed])
+        return samples, None
+    raise ValueError('Unknown variance reduction method %s. Valid values are plain, antithetic, control_variate, '
+                     'importance.' % method)
+
+
+def estimate_crash_probability(mu, sigma, dt, steps, n_paths, threshold=-0.203, method='importance', seed=None,
+                               chunk_size=10000, shift=None):
+    """
+    This function estimates the probability of a single step crash under GBM with a variance reduction technique,
+    and reports the estimate with its standard error. The steps of a GBM path are independent, so the probability of
+    a crash somewhere in a path follows from the single step probability
+    :param mu: The expected (annual) return
+    :param sigma: The annualized volatility
+    :param dt: The size of a single step, in years
+    :param steps: The number of points in every path, including the starting point
+    :param n_paths: The number of paths to simulate
+    :param threshold: The single step return that counts as a crash
+    :param method: 'plain', 'antithetic' (pairs every shock with its negative), 'control_variate' (uses the step
+    return, whose mean is known) or 'importance' (draws the shocks around the crash region)
+    :param seed: Seed for the random number generator, so that a simulation can be reproduced
+    :param chunk_size: The maximum number of paths held in memory at a time
+    :param shift: The mean of the importance sampling shocks, defaults to the shock at the crash threshold
+    :return: dict - The step and path crash probabilities (also as natural logs), with their standard errors and
+    the relative error of the step probability
+    """
+    drift = (mu - 0.5 * pow(sigma, 2)) * dt
+    diffusion = sigma * math.sqrt(dt)
+    crash_level = (math.log1p(threshold) - drift) / diffusion
+    if shift is None:
+        shift = crash_level
+    n_steps = int(steps) - 1
+
+    # Running sums of the samples (y) and the control variate (c)
+    sums = dict.fromkeys(['y', 'yy', 'c', 'cc', 'yc'], 0.0)
+    n_samples = 0
+    for chunk_paths, chunk_seed in _chunk_seeds(seed, n_paths, chunk_size):
+        shocks = np.random.RandomState(chunk_seed).standard_normal((chunk_paths, n_steps))
+        samples, control = _crash_estimator_samples(method, shocks, crash_level, drift, diffusion, shift)
+        n_samples += samples.size
+        sums['y'] += samples.sum()
+        sums['yy'] += np.dot(samples.ravel(), samples.ravel())
+        if control is not None:
+            sums['c'] += control.sum()
+            sums['cc'] += np.dot(control.ravel(), control.ravel())
+            sums['yc'] += np.dot(samples.ravel(), control.ravel())
+
+    step_probability = sums['y'] / n_samples
+    variance = sums['yy'] / n_samples - pow(step_probability, 2)
+    if method == 'control_variate':
+        control_mean = sums['c'] / n_samples
+        control_variance = sums['cc'] / n_samples - pow(control_mean, 2)
+        covariance = sums['yc'] / n_samples - step_probability * control_mean
+        step_probability -= covariance / control_variance * control_mean
+        variance -= pow(covariance, 2) / control_variance
+    step_standard_error = math.sqrt(max(variance, 0.0) / n_samples)
+    relative_error = step_standard_error / step_probability if step_probability > 0 else float('nan')
+
+    # Undo the scaling of the importance samples in log space, so that far tail estimates stay representable
+    log_scale = -0.5 * pow(shift, 2) if method == 'importance' else 0.0
+    step_log_probability = log_scale + math.log(step_probability) if step_probability > 0 else float('-inf')
+    step_probability = math.exp(step_log_probability)
+    step_standard_error *= math.exp(log_scale)
+
+    # Probability of at least one crash in a path, and its standard error by the delta method
+    path_probability = -math.expm1(n_steps * math.log1p(-step_probability))
+    path_standard_error = n_steps * math.exp((n_steps - 1) * math.log1p(-step_probability)) * step_standard_error
+    if path_probability > 0:
+        path_log_probability = math.log(path_probability)
+    else:
+        # For a vanishing step probability, the path probability is the step probability times the number of steps
+        path_log_probability = math.log(n_steps) + step_log_probability
+    return {'method': method,
+            'n_samples': n_samples,
+            'step_probability': step_probability,
+            'step_log_probability': step_log_probability,
+            'step_standard_error': step_standard_error,
+            'relative_error': relative_error,
+            'path_probability': path_probability,
+            'path_log_probability': path_log_probability,
+            'path_standard_error': path_standard_error}
+
+
+def gbm_crash_probability_exact(mu, sigma, dt, steps, threshold=-0.203):
+    """
+    This function calculates the exact probability of a single step crash under GBM with constant parameters. A log
+    return step is normally distributed, so the probability comes straight from the normal CDF, without simulation
+    :param mu: The expected (annual) return
+    :param sigma: The annualized volatility
+    :param dt: The size of a single step, in years
+    :param steps: The number of points in every path, including the starting point
+    :param threshold: The single step return that counts as a crash
+    :return: dict - The step and path crash probabilities (also as natural logs), and the expected crashes per path
+    """
+    n_steps = int(steps) - 1
+    crash_level = (math.log1p(threshold) - (mu - 0.5 * pow(sigma, 2)) * dt) / (sigma * math.sqrt(dt))
+    # The log of the CDF stays accurate far into the tail, where the CDF itself underflows
+    step_log_probability = float(scipy.special.log_ndtr(crash_level))
+    step_probability = math.exp(step_log_probability)
+    path_probability = -math.expm1(n_steps * math.log1p(-step_probability))
+    if path_probability > 0:
+        path_log_probability = math.log(path_probability)
+    else:
+        path_log_probability = math.log(n_steps) + step_log_probability
+    return {'method': 'exact',
+            'step_probability': step_probability,
+            'step_log_probability': step_log_probability,
+            'path_probability': path_probability,
+            'path_log_probability': path_log_probability,
+            'expected_crashes': n_steps * step_probability}
+
+
+def check_crash_probability(statistics, exact, tolerance=3.0):
+    """
+    This function checks a simulated single step crash probability against the exact one. The estimate is compared
+    as a ratio to the exact value, so that far tail probabilities can be compared in log space
+    :param statistics: The crash statistics of a simulation, from gbm_crash_statistics,
+    stream_gbm_crash_statistics or estimate_crash_probability
+    :param exact: The exact crash probabilities from gbm_crash_probability_exact
+    :param tolerance: The number of standard errors the estimate may be away from the exact value
+    :return: dict - The ratio of the estimate to the exact value, its standard error, the z-score and whether the
+    estimate is consistent with the exact value
+    """
+    if 'step_log_probability' in statistics:
+        log_estimate = statistics['step_log_probability']
+    elif statistics['step_probability'] > 0:
+        log_estimate = math.log(statistics['step_probability'])
+    else:
+        log_estimate = float('-inf')
+    ratio = math.exp(log_estimate - exact['step_log_probability'])
+    if not math.isnan(statistics.get('relative_error', float('nan'))):
+        ratio_error = statistics['relative_error'] * ratio
+    else:
+        # Without hits, or for plain sampling, count binomial hits with the exact probability of a hit
+        p = exact['step_probability']
+        ratio_error = math.sqrt((1 - p) / (statistics['n_samples'] * p)) if p > 0 else float('inf')
+    z_score = (ratio - 1) / ratio_error if ratio_error > 0 else float('nan')
+    return {'ratio': ratio,
+            'ratio_standard_error': ratio_error,
+            'z_score': z_score,
+            'consistent': abs(z_score) <= tolerance if ratio_error < float('inf') else True}
+
+
+def market_crash_probability(snp_data, n_paths=10, seed=None, plot=True, chunk_size=None, n_workers=1,
+                             method=None):
+    """
+    This function calculates the probability of a stock market crash using GBM
+    :param snp_data: the snp500 close price data
+    :param n_paths: The number of simulations to run
+    :param seed: Seed for the random number generator, so that a simulation can be reproduced
+    :param plot: Whether to plot the simulated paths and print the crashes of every simulation
+    :param chunk_size: If given, stream the simulation in chunks of this many paths, see stream_gbm_crash_statistics
+    :param n_workers: The number of processes the simulation is spread across. More than one streams the simulation,
+    in chunks of chunk_size paths or of an equal share of the paths of every process. Only the simulation of the
+    paths runs in parallel, so it has to be 1 with a method
+    :param method: If given, estimate the crash probability with this variance reduction method instead, see
+    estimate_crash_probability, or calculate it without simulation if 'exact'
+    :return: dict - The crash statistics from gbm_crash_statistics, stream_gbm_crash_statistics,
+    estimate_crash_probability or gbm_crash_probability_exact
+    """
+    if n_workers > 1 and method is not None:
+        raise ValueError('The %s method does not run in parallel, n_workers has to be 1.' % method)
+    parameters = gbm_crash_parameters(snp_data)
+    exact = gbm_crash_probability_exact(parameters['mu'], parameters['sigma'], parameters['dt'], parameters['steps'])
+    if method == 'exact':
+        print('The exact probability of a 1987 crash of SnP500 in a single step is: 10^%f'
+              % (exact['step_log_probability'] / math.log(10)))
+        print('The exact probability of a 1987 crash of SnP500 within a simulation is: 10^%f'
+              % (exact['path_log_probability'] / math.log(10)))
+        return exact
+    elif method is not None:
+        statistics = estimate_crash_probability(parameters['mu'], parameters['sigma'], parameters['dt'],
+                                                parameters['steps'], n_paths, method=method, seed=seed,
+                                                chunk_size=chunk_size or 10000)
+        print('The probability of a 1987 crash of SnP500 in a single step, estimated with %s sampling, is: '
+              '10^%f (relative error %f)' % (method, statistics['step_log_probability'] / math.log(10),
+                                             statistics['relative_error']))
+        print('The probability of a 1987 crash of SnP500 within a simulation is: 10^%f'
+              % (statistics['path_log_probability'] / math.log(10)))
+        print('Ratio of the estimated to the exact crash probability: %(ratio)f (z-score %(z_score)f)'
+              % check_crash_probability(statistics, exact))
+        return statistics
+    if chunk_size is None and n_workers > 1:
+        # Every process simulates about the same number of paths, in chunks that fit in memory
+        chunk_size = min(10000, -(-int(n_paths) // n_workers))
+    if chunk_size is not None:
+        # The paths are not kept in streaming mode, so there is nothing to plot
+        statistics = stream_gbm_crash_statistics(n_paths=n_paths, chunk_size=chunk_size, seed=seed,
+                                                 n_workers=n_workers, **parameters)
+        print('Lowest single step return in %d simulations: %f' % (n_paths, statistics['min_return']))
+        for quantile, price in sorted(statistics['terminal_quantiles'].items()):
+            print('%.0f%% quantile of the simulated SnP500 price: %f' % (quantile * 100, price))
+    else:
+        log_paths = simulate_gbm_log_paths(n_paths=n_paths, seed=seed, **parameters)
+        # Where returns are less than a 20.3% drop, which was a single day crash in 1987
+        statistics = gbm_crash_statistics(log_paths)
+
+        if plot:
+            plt.plot(np.exp(log_paths.T))
+            plt.xlabel('Steps')
+            plt.ylabel('SnP500 Prices')
+            plt.show()
+            for index, row in enumerate(statistics['crash_counts']):
+                print('The probability of a 1987 crash of SnP500, where a single intraday crash was 20.3%, '
+                      'using GBM with the ' + str(index) + ' simulation is: ' + str(row))
+    print('Paths with a 1987 crash of SnP500 in %d simulations: %d (probability %f)'
+          % (n_paths, statistics['paths_with_crash'], statistics['path_probability']))
+    print('Ratio of the simulated to the exact crash probability: %(ratio)f (z-score %(z_score)f)'
+          % check_crash_probability(statistics, exact))
+    return statistics
+
+
+def market_log_returns(data_dict):
+    """
+    This function builds the daily log returns of the close prices of every market, aligned on the days where all
+    the markets traded
+    :param data_dict: The dictionary containing the DataFrames
+    :return: pd.DataFrame - The log returns, with a column per market
+    """
+    return pd.concat(dict((key, np.log(value['Close']).diff()) for key, value in data_dict.items()),
+                     axis=1).dropna()
+
+
+def _joint_crash_shifts(cholesky, crash_levels, min_markets):
+    """
+    This function returns the importance sampling shifts of the independent shocks for a joint crash: one for every
+    set of min_markets markets, moving the mean of the shocks to the most likely point where all of them crash at once
+    :param cholesky: The Cholesky factor of the covariance of the daily log returns
+    :param crash_levels: The daily log return below which every market crashes, less its drift
+    :param min_markets: The number of markets that have to crash on the same day for a joint crash
+    :return: np.ndarray - The shifts, one per row
+    """
+    shifts = []
+    for markets in itertools.combinations(range(len(crash_levels)), int(min_markets)):
+        rows = cholesky[list(markets)]
+        # The shortest vector of shocks that takes the markets to their crash levels
+        shifts.append(np.dot(rows.T, np.linalg.solve(np.dot(rows, rows.T), crash_levels[list(markets)])))
+    return np.array(shifts)
+
+
+def simulate_correlated_crashes(log_returns, n_paths, steps=252, threshold=-0.203, min_markets=2, volatility=None,
+                                seed=None, chunk_size=1000):
+    """
+    This function calculates how often several markets following correlated GBM crash on the same day. The crash
+    probability of every market on its own is exact, from the normal CDF. The joint crashes are many standard
+    deviations away, so plain sampling never hits them: their probability is estimated with importance sampling
+    instead, like estimate_crash_probability, drawing the shocks around the most likely joint crash of every set of
+    min_markets markets in turn and weighting them with the likelihood ratio of the mixture. The shocks of all the
+    markets are correlated with a single matrix multiply by the Cholesky factor of the covariance of the daily log
+    returns, and the days are independent, so the probability within a path follows from the daily one
+    :param log_returns: DataFrame of daily log returns with a column per market, see market_log_returns
+    :param n_paths: The number of paths to simulate
+    :param steps: The number of days in every path
+    :param threshold: The daily return that counts as a crash
+    :param min_markets: The number of markets that have to crash on the same day for a joint crash
+    :param volatility: If given, the annualized volatility of every market, keeping the correlations of the data
+    :param seed: Seed for the random number generator, so that a simulation can be reproduced
+    :param chunk_size: The maximum number of paths held in memory at a time
+    :return: dict - The exact crash probability per market and day, the estimated probability of a joint crash per
+    day (also as a natural log, with its standard error) and per path, and the estimated probability of every number
+    of markets crashing on the same day, from min_markets up
+    """
+    drift = log_returns.mean().values
+    covariance = log_returns.cov().values
+    if volatility is not None:
+        scale = volatility / math.sqrt(252) / np.sqrt(np.diag(covariance))
+        covariance = covariance * np.outer(scale, scale)
+    cholesky = np.linalg.cholesky(covariance)
+    crash_levels = math.log1p(threshold) - drift
+    n_markets = len(drift)
+
+    market_log_probability = scipy.special.log_ndtr(crash_levels / np.sqrt(np.diag(covariance)))
+    shifts = _joint_crash_shifts(cholesky, crash_levels, min_markets)
+    shift_norms = 0.5 * (shifts ** 2).sum(axis=1)
+    # The likelihood ratios underflow in the far tail, so they are scaled up by exp(min(shift_norms)), and the scale
+    # is undone in log space, as in estimate_crash_probability
+    log_scale = shift_norms.min()
+
+    sums = dict.fromkeys(['y', 'yy'], 0.0)
+    crash_count_sums = np.zeros(n_markets + 1)
+    n_days = 0
+    for chunk_paths, chunk_seed in _chunk_seeds(seed, n_paths, chunk_size):
+        random_state = np.random.RandomState(chunk_seed)
+        shocks = random_state.standard_normal((chunk_paths * int(steps), n_markets))
+        shocks += shifts[random_state.randint(len(shifts), size=len(shocks))]
+        markets_crashing = (np.dot(shocks, cholesky.T) < crash_levels).sum(axis=1)
+        log_ratios = scipy.special.logsumexp(np.dot(shocks, shifts.T) - shift_norms, axis=1) - math.log(len(shifts))
+        samples = np.where(markets_crashing >= min_markets, np.exp(log_scale - log_ratios), 0.0)
+        n_days += len(samples)
+        sums['y'] += samples.sum()
+        sums['yy'] += np.dot(samples, samples)
+        crash_count_sums += np.bincount(markets_crashing, weights=samples, minlength=n_markets + 1)
+
+    joint_probability = sums['y'] / n_days
+    standard_error = math.sqrt(max(sums['yy'] / n_days - pow(joint_probability, 2), 0.0) / n_days)
+    relative_error = standard_error / joint_probability if joint_probability > 0 else float('nan')
+    joint_log_probability = math.log(joint_probability) - log_scale if joint_probability > 0 else float('-inf')
+    joint_probability = math.exp(joint_log_probability)
+    path_joint_probability = -math.expm1(int(steps) * math.log1p(-joint_probability))
+    crash_count_distribution = pd.Series(crash_count_sums[int(min_markets):] / n_days * math.exp(-log_scale),
+                                         index=range(int(min_markets), n_markets + 1), name='Probability')
+    crash_count_distribution.index.name = 'Markets Crashing'
+    return {'market_probability': pd.Series(np.exp(market_log_probability), index=log_returns.columns),
+            'market_log_probability': pd.Series(market_log_probability, index=log_returns.columns),
+            'joint_probability': joint_probability,
+            'joint_log_probability': joint_log_probability,
+            'joint_standard_error': standard_error * math.exp(-log_scale),
+            'relative_error': relative_error,
+            'path_joint_probability': path_joint_probability,
+            'crash_count_distribution': crash_count_distribution}
 
 
 def hurst(size, nasdaq_close_price):
@@ -281,6 +860,53 @@ def hurst(size, nasdaq_close_price):
     return np.log(En)
 
 
+def rescaled_range_analysis(series, n_scales=None, min_window=8):
+    """
+    This function does a rescaled range (R/S) analysis of a series, or of every row of a 2-D array of series. At
+    every scale the series is split into non-overlapping windows of n, n/2, n/4, ... observations, and the rescaled
+    range is averaged over all the windows of that scale. The Hurst exponent is the slope of the log of the average
+    rescaled range against the log of the window size
+    :param series: Array of observations, or 2-D array with a series per row
+    :param n_scales: The number of scales, defaults to as many as keep the windows at least min_window long
+    :param min_window: The smallest window size used when n_scales is not given
+    :return: dict - The Hurst exponent, intercept, R squared and standard error of the fit, along with the log window
+    sizes and log rescaled ranges that were fitted
+    """
+    series = np.asarray(series, dtype=float)
+    n = series.shape[-1]
+    if n_scales is None:
+        n_scales = int(math.floor(math.log(n / float(min_window), 2))) + 1
+    window_sizes = n // 2 ** np.arange(int(n_scales))
+
+    log_rescaled_range = []
+    for size in window_sizes:
+        # Every row of the reshaped array is one window of the series
+        windows = series[..., :n // size * size].reshape(series.shape[:-1] + (n // size, size))
+        deviations = np.cumsum(windows - windows.mean(axis=-1)[..., np.newaxis], axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rescaled = (deviations.max(axis=-1) - deviations.min(axis=-1)) / windows.std(axis=-1)
+        log_rescaled_range.append(np.log(np.nanmean(rescaled, axis=-1)))
+    log_rescaled_range = np.stack(log_rescaled_range, axis=-1)
+
+    # Least squares fit of the log rescaled range against the log window size, for every series at once
+    x = np.log(window_sizes)
+    x_centred = x - x.mean()
+    y_centred = log_rescaled_range - log_rescaled_range.mean(axis=-1)[..., np.newaxis]
+    sxx = np.dot(x_centred, x_centred)
+    slope = np.dot(y_centred, x_centred) / sxx
+    residuals = y_centred - np.multiply.outer(slope, x_centred)
+    sse = (residuals ** 2).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = 1 - sse / (y_centred ** 2).sum(axis=-1)
+        standard_error = np.sqrt(sse / (len(x) - 2) / sxx)
+    return {'hurst': slope,
+            'intercept': log_rescaled_range.mean(axis=-1) - slope * x.mean(),
+            'r_squared': r_squared,
+            'standard_error': standard_error,
+            'log_window_sizes': x,
+            'log_rescaled_range': log_rescaled_range}
+
+
 def generateYn(x, results):
     yn = []
     interCept = results.params[0]
@@ -290,21 +916,103 @@ def generateYn(x, results):
     return yn
 
 
-def hurst_ts(ts):
-    """Returns the Hurst Exponent of the time series vector ts"""
-    # Create the range of lag values
-    lags = range(2, 100)
+def lagged_difference_std(series, lags):
+    """
+    This function calculates the standard deviation of the lagged differences ts[lag:] - ts[:-lag] of every row of a
+    2-D array of series, for all the lags at once. The sums of the differences and of their squares come from
+    cumulative sums of the series, so only the cross products are summed per lag, without building the differences
+    :param series: 2-D array with a series per row
+    :param lags: The lags to calculate the standard deviations for
+    :return: np.ndarray - Array of shape (series, lags) containing the standard deviations
+    """
+    series = np.asarray(series, dtype=float)
+    # Centre every series, so that the sums of squares do not lose precision to the level of the series
+    series = series - series.mean(axis=1)[:, np.newaxis]
+    n = series.shape[1]
+    cumulative = np.zeros((series.shape[0], n + 1))
+    np.cumsum(series, axis=1, out=cumulative[:, 1:])
+    cumulative_squares = np.zeros((series.shape[0], n + 1))
+    np.cumsum(series ** 2, axis=1, out=cumulative_squares[:, 1:])
+
+    variance = np.empty((series.shape[0], len(lags)))
+    for index, lag in enumerate(lags):
+        count = n - lag
+        sum_difference = cumulative[:, n] - cumulative[:, lag] - cumulative[:, count]
+        cross = np.einsum('ij,ij->i', series[:, lag:], series[:, :count])
+        sum_squares = cumulative_squares[:, n] - cumulative_squares[:, lag] + cumulative_squares[:, count] - 2 * cross
+        variance[:, index] = sum_squares / count - (sum_difference / count) ** 2
+    return np.sqrt(np.maximum(variance, 0, out=variance), out=variance)
 
-    # Calculate the array of the variances of the lagged differences
-    tau = [np.sqrt(np.std(np.subtract(ts[lag:], ts[:-lag]))) for lag in lags]
 
-    # Use a linear fit to estimate the Hurst Exponent
-    poly = np.polyfit(np.log(lags), np.log(tau), 1)
+def hurst_ts_batch(series, lags=None):
+    """
+    Returns the Hurst Exponent of every row of a 2-D array of series, for example tickers x days
+    :param series: 2-D array with a series per row
+    :param lags: The lags of the differences, defaults to 2 up to 99
+    :return: np.ndarray - The Hurst Exponent of every series
+    """
+    if lags is None:
+        lags = range(2, 100)
+    # The square root of the standard deviations of the lagged differences
+    tau = np.sqrt(lagged_difference_std(series, lags))
 
-    # Return the Hurst exponent from the polyfit output
+    # Use a linear fit of every series at once to estimate the Hurst Exponents
+    poly = np.polyfit(np.log(lags), np.log(tau).T, 1)
     return poly[0] * 2.0
 
 
+def hurst_ts(ts, lags=None):
+    """Returns the Hurst Exponent of the time series vector ts"""
+    return hurst_ts_batch(np.asarray(ts, dtype=float)[np.newaxis, :], lags)[0]
+
+
+def rolling_hurst(series, window=512, step=1, lags=None):
+    """
+    This function calculates the Hurst Exponent (the same as hurst_ts) and the Fractal Dimension over a rolling
+    window. Instead of fitting every window from scratch, the lagged differences of the whole series are built once
+    per lag, and the sums of every window are read off their cumulative sums, so the cost does not grow with the
+    window size
+    :param series: Series, or DataFrame with a series per column, for example of log close prices. It may not have
+    missing values
+    :param window: The number of observations in a window
+    :param step: The number of observations the window moves by
+    :param lags: The lags of the differences, defaults to 2 up to 99
+    :return: pd.DataFrame - The 'Hurst' and 'Fractal Dimension' of the window ending on every date of the index of the
+    series, NaN where no window ends. A DataFrame has a column per series under each of the two
+    """
+    if lags is None:
+        lags = range(2, 100)
+    values = np.asarray(series, dtype=float).reshape(len(series), -1).T
+    ends = np.arange(window - 1, values.shape[1], step)
+    starts = ends - window + 1
+
+    log_tau = np.empty((len(lags),) + values.shape[:1] + ends.shape)
+    for index, lag in enumerate(lags):
+        differences = values[:, lag:] - values[:, :-lag]
+        # Cumulative sums with a leading zero, so that the sum of a window is the difference of two entries
+        cumulative = np.zeros((values.shape[0], differences.shape[1] + 1))
+        np.cumsum(differences, axis=1, out=cumulative[:, 1:])
+        cumulative_squares = np.zeros_like(cumulative)
+        np.cumsum(differences ** 2, axis=1, out=cumulative_squares[:, 1:])
+        count = float(window - lag)
+        mean = (cumulative[:, starts + window - lag] - cumulative[:, starts]) / count
+        mean_squares = (cumulative_squares[:, starts + window - lag] - cumulative_squares[:, starts]) / count
+        # The log of the square root of the standard deviation
+        log_tau[index] = 0.25 * np.log(np.maximum(mean_squares - mean ** 2, 0))
+
+    # Slope of the linear fit of every window at once
+    log_lags = np.log(lags)
+    log_lags = log_lags - log_lags.mean()
+    slopes = np.tensordot(log_lags, log_tau, axes=1) / np.dot(log_lags, log_lags)
+
+    columns = series.columns if isinstance(series, pd.DataFrame) else [series.name]
+    hurst_exponents = pd.DataFrame(np.nan, index=series.index, columns=columns)
+    hurst_exponents.iloc[ends] = 2.0 * slopes.T
+    if not isinstance(series, pd.DataFrame):
+        hurst_exponents = hurst_exponents.iloc[:, 0]
+    return pd.concat([hurst_exponents, 2 - hurst_exponents], axis=1, keys=['Hurst', 'Fractal Dimension'])
+
+
 def main():
     """
         This function is called from the main block. The purpose of this function is to contain all the calls to
@@ -313,14 +1021,12 @@ def main():
         """
     # Wrap in a try block so that we catch any exceptions thrown by other functions and return a 1 for graceful exit
     try:
-        # ===== Step 0: Sanitation =====
-        # Fix Pandas Datareader's Issues with Yahoo Finance (Since yahoo abandoned it's API)
-        yahoo_finance_bridge()
 
         # ===== Step 1: Fetching end of day data for the last 25 years for the four indexes in play =====
-        data = pdr.get_data_yahoo(['^DJI', '^GSPC', '^IXIC', '^GDAXI', '^FTSE', '^HSI', '^KS11', '^NSEI'],
-                                  start="1991-10-01", end="2017-10-01", as_panel=False, group_by='index',
-                                  auto_adjust=True)
+        # Only the dates missing from the local cache are downloaded, columns are grouped by index
+        data = pd.concat(dict((ticker, market_data.get_history(ticker, "1991-10-01", "2017-10-01"))
+                              for ticker in ['^DJI', '^GSPC', '^IXIC', '^GDAXI', '^FTSE', '^HSI', '^KS11', '^NSEI']),
+                         axis=1)
         # Assign them to variables,
         # Interpolate holes, using a simple Linear Interpolation,
         # and drop NaN rows that could not be interpolated, since backfilling could skew results
@@ -355,6 +1061,16 @@ def main():
 
         # ===== Step 5: GBM stock market crash probability =====
         market_crash_probability(SP500.loc['2016':'2016'].interpolate())
+        # Plain sampling hardly ever hits the crash, so estimate its probability with importance sampling as well
+        market_crash_probability(SP500.loc['2016':'2016'].interpolate(), n_paths=10000, method='importance')
+        market_crash_probability(SP500.loc['2016':'2016'].interpolate(), method='exact')
+        # Joint crashes of all the markets, with correlated shocks and about 20% historical volatility
+        joint_crashes = simulate_correlated_crashes(market_log_returns(data_dict), n_paths=1000, volatility=0.20)
+        print('Probability of a 1987 crash per day for every market:\n%s' % joint_crashes['market_probability'])
+        print('Probability of two or more markets crashing on the same day: 10^%f (relative error %f)'
+              % (joint_crashes['joint_log_probability'] / math.log(10), joint_crashes['relative_error']))
+        print('Probability of two or more markets crashing on the same day within a year: %e'
+              % joint_crashes['path_joint_probability'])
 
         # ===== Step 6: Plot distribution to identify fat tails =====
         plot_qq_plot(data, both=False)
@@ -362,18 +1078,10 @@ def main():
         # ===== Step 7: Plot distribution to identify fat tails =====
         nasdaq_10_years = data['^IXIC']['2006':'2016']
         nasdaq_close_price = nasdaq_10_years['Close'].interpolate().dropna()
-        y = [hurst(np.size(nasdaq_close_price), nasdaq_close_price),
-             hurst(np.size(nasdaq_close_price) / 2, nasdaq_close_price),
-             hurst(np.size(nasdaq_close_price) / 4, nasdaq_close_price),
-             hurst(np.size(nasdaq_close_price) / 8, nasdaq_close_price),
-             hurst(np.size(nasdaq_close_price) / 16, nasdaq_close_price),
-             hurst(np.size(nasdaq_close_price) / 32, nasdaq_close_price)]
-        x = [np.log(np.size(nasdaq_close_price)),
-             np.log(np.size(nasdaq_close_price) / 2),
-             np.log(np.size(nasdaq_close_price) / 4),
-             np.log(np.size(nasdaq_close_price) / 8),
-             np.log(np.size(nasdaq_close_price) / 16),
-             np.log(np.size(nasdaq_close_price) / 32)]
+        # Rescaled range at the sizes n, n/2, ..., n/32, averaged over all the windows of every size
+        rescaled_range = rescaled_range_analysis(nasdaq_close_price.values, n_scales=6)
+        y = rescaled_range['log_rescaled_range']
+        x = rescaled_range['log_window_sizes']
         xx = sm.add_constant(x)
         model = sm.OLS(y, xx)
         results = model.fit()
@@ -406,6 +1114,15 @@ def main():
         elif nasdaq_hurst < 0.5 and fractal_dim > 1.5:
             print('The given Hurst expression is anti-persisting, that is, it is mean reverting')
 
+        # ===== Rolling Hurst Exponent of all the indices, to detect regime changes =====
+        log_close = np.log(pd.DataFrame(dict((key, value['Close']) for key, value in data_dict.items())).dropna())
+        rolling_hurst_exponents = rolling_hurst(log_close, window=512)
+        rolling_hurst_exponents['Hurst'].plot()
+        plt.axhline(0.5, color='k', linestyle='--')
+        plt.grid(True)
+        plt.title("Rolling 512 Day Hurst Exponent")
+        plt.show()
+
     except BaseException, e:
         # Casting a wide net to catch all exceptions
         print('\n%s' % str(e))
@@ -0,0 +1,78 @@
+"""
+@author: Osama Iqbal
+
+Code uses Python 2.7, packaged with Anaconda 4.4.0
+
+Tests of the Final Project: the crash probabilities of correlated markets from simulate_correlated_crashes against
+their analytic values under the normal distribution.
+
+Usage: python -m unittest discover -s Final
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import math  # For the analytic probabilities
+import unittest  # The test framework
+import numpy as np  # For generating the log returns
+import pandas as pd  # For the log returns table
+import scipy.integrate  # For the bivariate normal probabilities
+import scipy.special  # For the normal CDF
+
+import Osama_Iqbal_Final_Project as final  # The crash simulations of the Final Project
+
+
+def bivariate_normal_log_cdf(a, b, rho):
+    """
+    This function calculates the log of the probability that two standard normal variables with correlation rho are
+    below a and b, integrating over the first one. The integrand is scaled by its value at a, so that the probability
+    stays accurate far into the tail
+    :param a: The bound of the first variable
+    :param b: The bound of the second variable
+    :param rho: The correlation of the two variables
+    :return: float - The log of the probability
+    """
+    spread = math.sqrt(1 - rho ** 2)
+    log_tail = scipy.special.log_ndtr((b - rho * a) / spread)
+
+    def integrand(t):
+        return math.exp(a * t - 0.5 * t ** 2 + scipy.special.log_ndtr((b - rho * (a - t)) / spread) - log_tail)
+
+    integral = scipy.integrate.quad(integrand, 0, np.inf, epsabs=0, epsrel=1e-10)[0]
+    return -0.5 * a ** 2 - 0.5 * math.log(2 * math.pi) + log_tail + math.log(integral)
+
+
+class CorrelatedCrashesTest(unittest.TestCase):
+
+    def setUp(self):
+        covariance = np.array([[1.0, 0.6], [0.6, 1.5]]) * 1e-4
+        self.log_returns = pd.DataFrame(np.random.RandomState(0).multivariate_normal([0, 0], covariance, size=5000),
+                                        columns=['A', 'B'])
+        self.covariance = self.log_returns.cov().values
+        self.drift = self.log_returns.mean().values
+
+    def crash_levels(self, threshold):
+        return (math.log1p(threshold) - self.drift) / np.sqrt(np.diag(self.covariance))
+
+    def test_market_probability(self):
+        crashes = final.simulate_correlated_crashes(self.log_returns, n_paths=10, threshold=-0.1, seed=0)
+        np.testing.assert_allclose(crashes['market_log_probability'].values,
+                                   scipy.special.log_ndtr(self.crash_levels(-0.1)))
+
+    def test_joint_probability(self):
+        rho = self.covariance[0, 1] / math.sqrt(self.covariance[0, 0] * self.covariance[1, 1])
+        for threshold in [-0.03, -0.1]:
+            crashes = final.simulate_correlated_crashes(self.log_returns, n_paths=200, threshold=threshold, seed=1)
+            exact = bivariate_normal_log_cdf(self.crash_levels(threshold)[0], self.crash_levels(threshold)[1], rho)
+            # Far in the tail, where plain sampling would never see a joint crash
+            self.assertGreater(crashes['joint_probability'], 0)
+            self.assertLess(abs(math.exp(crashes['joint_log_probability'] - exact) - 1),
+                            4 * crashes['relative_error'])
+            self.assertAlmostEqual(crashes['crash_count_distribution'].sum(), crashes['joint_probability'],
+                                   delta=1e-9 * crashes['joint_probability'])
+
+
+if __name__ == '__main__':
+    unittest.main()
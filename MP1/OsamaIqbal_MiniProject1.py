@@ -22,26 +22,16 @@ __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
 import sys  # For gracefully notifying whether the script has ended or not
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
-import warnings  # For removing Deprication Warning w.r.t. Yahoo Finance Fix
 import datetime  # For setting correct dates from today up to a year in the past to get data from YF
 import numpy as np  # For numerical operations
 import scipy.interpolate  # For fitting quadratic curve
 import scipy.optimize  # For Optimization Problems
+import scipy.special  # For the binomial coefficients of the rolling fit
 import pylab  # For plotting the graphs
 
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
-
-
-def yahoo_finance_bridge():
-    """
-    This function fixes problems w.r.t. fetching data from Yahoo Finance
-    :return: None
-    """
-    logging.info('Correcting Yahoo Finance')
-    pdr_override()
+import os  # For locating the shared market data module
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import market_data  # Shared on-disk cache of the market data, in the root of the repository
 
 
 def get_ticker_from_user():
@@ -62,7 +52,7 @@ def get_data_from_yahoo_finance(stock_ticker):
     """
     today = datetime.datetime.now().date()
     previous_month = today.replace(month=today.month - 1)
-    data = pdr.get_data_yahoo(stock_ticker, start=str(previous_month), end=str(today), auto_adjust=True)
+    data = market_data.get_history(stock_ticker, previous_month, today)
     if data.empty:
         logging.info('No Data found for Ticker %s. The ticker does not exist' % stock_ticker)
         raise ValueError('No Data found for Ticker %s. The ticker does not exist' % stock_ticker)
@@ -70,6 +60,98 @@ def get_data_from_yahoo_finance(stock_ticker):
         return data
 
 
+# Cache of the quadratic splines of the close prices, by (ticker, start, end)
+_close_price_splines = {}
+
+
+def quadratic_spline(values, axis=-1):
+    """
+    This function builds the quadratic interpolating splines of many series at once, through the points 0, 1, 2, ...
+    along an axis, as scipy.interpolate.interp1d(kind='quadratic') does for a single series
+    :param values: The series, one per position of the other axes
+    :param axis: The axis along which the series run
+    :return: scipy.interpolate.BSpline - The splines, which evaluate all the series at once on any grid
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return scipy.interpolate.make_interp_spline(np.arange(values.shape[axis]), values, k=2, axis=axis)
+
+
+def interpolation_grid(n_points, n_samples=100):
+    """
+    This function returns an evenly spaced grid over the points of a series
+    :param n_points: The number of points in the series
+    :param n_samples: The number of points in the grid
+    :return: np.ndarray - The grid, from the first point 0 to the last point n_points - 1
+    """
+    return np.linspace(0, n_points - 1, n_samples)
+
+
+def interpolate_quadratic(values, grid=None, axis=-1):
+    """
+    This function interpolates many series at once with quadratic splines, and evaluates them on a grid
+    :param values: The series, one per position of the other axes
+    :param grid: The points to evaluate the splines at, defaults to interpolation_grid over the series
+    :param axis: The axis along which the series run
+    :return: tuple - The grid, and the interpolated values, with the axis of the series replaced by the grid
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if grid is None:
+        grid = interpolation_grid(values.shape[axis])
+    return grid, quadratic_spline(values, axis)(grid)
+
+
+def close_price_splines(tickers, start, end, histories=None):
+    """
+    This function returns the quadratic splines of the close prices of many tickers between two dates. The splines
+    are cached by (ticker, start, end), and the missing ones of the same length are built together
+    :param tickers: The Ticker symbols
+    :param start: The first date
+    :param end: The last date
+    :param histories: Optional mapping of the tickers to DataFrames of their data between the two dates, which are
+    otherwise fetched with market_data.get_history
+    :return: list - The scipy.interpolate.BSpline of every ticker
+    """
+    histories = histories or {}
+    missing = {}
+    for ticker in tickers:
+        if (ticker, start, end) not in _close_price_splines:
+            history = histories.get(ticker)
+            if history is None:
+                history = market_data.get_history(ticker, start, end)
+            close_price = np.asarray(history['Close'], dtype=np.float64)
+            missing.setdefault(len(close_price), []).append((ticker, close_price))
+    for same_length in missing.values():
+        splines = quadratic_spline(np.column_stack([close_price for _, close_price in same_length]), axis=0)
+        for column, (ticker, _) in enumerate(same_length):
+            _close_price_splines[ticker, start, end] = scipy.interpolate.BSpline(splines.t, splines.c[:, column], 2)
+    return [_close_price_splines[ticker, start, end] for ticker in tickers]
+
+
+def interpolate_close_prices(tickers, start, end, grid=None, histories=None):
+    """
+    This function interpolates the close prices of many tickers between two dates with quadratic splines, and
+    evaluates them on a grid, without any plotting. The splines are cached, so it is cheap to call in a loop
+    :param tickers: The Ticker symbols
+    :param start: The first date
+    :param end: The last date
+    :param grid: The points to evaluate the splines at, defaults to interpolation_grid over the close prices, which
+    then need to have the same number of days for every ticker
+    :param histories: Optional mapping of the tickers to DataFrames of their data between the two dates
+    :return: tuple - The grid, and the interpolated close prices (tickers x grid)
+    """
+    splines = close_price_splines(tickers, start, end, histories)
+    lengths = set(len(spline.c) for spline in splines)
+    if grid is None:
+        if len(lengths) > 1:
+            raise ValueError('The tickers have different numbers of days. Please give a grid to interpolate them on.')
+        grid = interpolation_grid(lengths.pop())
+    if all(np.array_equal(spline.t, splines[0].t) for spline in splines):
+        # All the splines share their knots, so they are evaluated at once
+        coefficients = np.column_stack([spline.c for spline in splines])
+        return grid, scipy.interpolate.BSpline(splines[0].t, coefficients, 2)(grid).T
+    return grid, np.array([spline(grid) for spline in splines])
+
+
 def quadratic_interpolation_with_plot(x_array_dim, x_label):
     """
     Perform Quadratic Interpolation with plotting of the graph
@@ -77,10 +159,7 @@ def quadratic_interpolation_with_plot(x_array_dim, x_label):
     :param x_label: The X axis label value
     :return: None
     """
-    granular_time_step = np.linspace(0, 20, 100)
-    time_step = np.arange(0, len(x_array_dim))
-    interpreted = scipy.interpolate.interp1d(time_step, x_array_dim, kind='quadratic')
-    y1 = interpreted(granular_time_step)
+    granular_time_step, y1 = interpolate_quadratic(x_array_dim)
     pylab.plot(x_array_dim, 'o', label='Actual Data Values (%s)' % x_label)
     pylab.plot(granular_time_step, y1, label='Quadratic Fit (%s)' % x_label)
     pylab.legend()
@@ -97,20 +176,285 @@ def errfunc(p, t, y):
     return fitfunc(p, t) - y
 
 
-def best_fit_with_plot(close_price):
+class TrendModel(object):
+    """
+    Base class of the trend models fitted to the close prices with leastsq. A model is called with its parameters and
+    the time steps, and supplies the analytic Jacobian of its residuals, so that leastsq does not have to estimate it
+    by finite differences with extra evaluations of the model
+    """
+    # The name of the model, as given to get_model
+    name = None
+
+    def __call__(self, p, t):
+        """
+        This function evaluates the model
+        :param p: The parameters
+        :param t: The time steps
+        :return: np.ndarray - The fitted close prices
+        """
+        raise NotImplementedError
+
+    def residuals(self, p, t, y):
+        """
+        This function returns the residuals of the model, as errfunc does
+        :param p: The parameters
+        :param t: The time steps
+        :param y: The close prices
+        :return: np.ndarray - The residuals
+        """
+        return self(p, t) - y
+
+    def jacobian(self, p, t, y):
+        """
+        This function returns the Jacobian of the residuals with respect to the parameters
+        :param p: The parameters
+        :param t: The time steps
+        :param y: The close prices
+        :return: np.ndarray - The (time steps x parameters) Jacobian
+        """
+        raise NotImplementedError
+
+    def guess(self, t, y):
+        """
+        This function returns the initial guess of the parameters for leastsq
+        :param t: The time steps
+        :param y: The close prices
+        :return: np.ndarray - The parameters
+        """
+        raise NotImplementedError
+
+
+class QuadraticModel(TrendModel):
+    """
+    The quadratic p0 * t ** 2 + p1 * t of fitfunc, without an intercept
+    """
+    name = 'quadratic'
+
+    def __call__(self, p, t):
+        return fitfunc(p, t)
+
+    def jacobian(self, p, t, y):
+        return np.column_stack([t ** 2, t]).astype(np.float64)
+
+    def guess(self, t, y):
+        return np.array([y.max(), y.min()])
+
+
+class PolynomialModel(TrendModel):
+    """
+    A polynomial of any degree with an intercept, p0 + p1 * t + ... + pk * t ** k
+    """
+
+    def __init__(self, degree):
+        self.degree = degree
+        self.name = 'polynomial:%d' % degree
+
+    def __call__(self, p, t):
+        return np.polyval(p[::-1], t)
+
+    def jacobian(self, p, t, y):
+        return np.vander(np.asarray(t, dtype=np.float64), self.degree + 1, increasing=True)
+
+    def guess(self, t, y):
+        return np.r_[y.mean(), np.zeros(self.degree)]
+
+
+class ExponentialModel(TrendModel):
+    """
+    The exponential trend p0 * exp(p1 * t), fitted to the close prices
+    """
+    name = 'exponential'
+
+    def __call__(self, p, t):
+        return p[0] * np.exp(p[1] * t)
+
+    def jacobian(self, p, t, y):
+        growth = np.exp(p[1] * t)
+        return np.column_stack([growth, p[0] * t * growth])
+
+    def guess(self, t, y):
+        rate = np.log(y[-1] / y[0]) / (t[-1] - t[0])
+        return np.array([y[0] * np.exp(-rate * t[0]), rate])
+
+
+class LogLinearModel(TrendModel):
+    """
+    The log-linear trend log(y) = p0 + p1 * t, fitted to the log of the close prices
+    """
+    name = 'log-linear'
+
+    def __call__(self, p, t):
+        return np.exp(p[0] + p[1] * t)
+
+    def residuals(self, p, t, y):
+        return p[0] + p[1] * t - np.log(y)
+
+    def jacobian(self, p, t, y):
+        return np.column_stack([np.ones(len(t)), t]).astype(np.float64)
+
+    def guess(self, t, y):
+        return np.array([np.log(y).mean(), 0.0])
+
+
+def get_model(name):
+    """
+    This function returns a trend model by its name
+    :param name: quadratic (fitfunc), polynomial:<degree>, exponential or log-linear
+    :return: TrendModel - The model
+    """
+    kind, _, degree = name.partition(':')
+    if kind == 'quadratic':
+        return QuadraticModel()
+    elif kind == 'polynomial' and degree.isdigit():
+        return PolynomialModel(int(degree))
+    elif kind == 'exponential':
+        return ExponentialModel()
+    elif kind == 'log-linear':
+        return LogLinearModel()
+    raise ValueError('Unknown trend model %s. Valid models are quadratic, polynomial:<degree>, exponential and '
+                     'log-linear.' % name)
+
+
+def fit_model(model, close_price, analytic_jacobian=True):
+    """
+    This function fits a trend model to the close prices with leastsq
+    :param model: TrendModel - The model, see get_model
+    :param close_price: The array to fit
+    :param analytic_jacobian: Whether to give leastsq the analytic Jacobian of the model, instead of letting it
+    estimate the Jacobian by finite differences
+    :return: dict - With the parameters, the residuals, the fitted close prices, the number of evaluations of the
+    model and of its Jacobian, and whether leastsq converged
+    """
+    t = np.arange(1, len(close_price) + 1, dtype=np.float64)
+    y = np.asarray(close_price, dtype=np.float64)
+    parameters, _, info, message, flag = scipy.optimize.leastsq(
+        model.residuals, model.guess(t, y), args=(t, y), Dfun=model.jacobian if analytic_jacobian else None,
+        full_output=True)
+    return {'parameters': parameters, 'residuals': model.residuals(parameters, t, y), 'fitted': model(parameters, t),
+            'evaluations': info['nfev'], 'jacobian_evaluations': info.get('njev', 0), 'converged': flag in (1, 2, 3, 4)}
+
+
+# Cache of the design matrix and its pseudo-inverse for every number of days, shared by all the fits of that length
+_quadratic_pseudo_inverses = {}
+
+
+def quadratic_pseudo_inverse(n_days):
+    """
+    This function returns the design matrix of fitfunc for a number of days, along with its pseudo-inverse. The model
+    is linear in its parameters, so the least squares fit of any series of that length is the pseudo-inverse times
+    the series. Both are computed once per number of days, and cached
+    :param n_days: The number of days in the series
+    :return: tuple - The (n_days x 2) design matrix with columns t ** 2 and t for t = 1 .. n_days, and its (2 x n_days)
+    pseudo-inverse
+    """
+    if n_days not in _quadratic_pseudo_inverses:
+        t = np.arange(1, n_days + 1, dtype=np.float64)
+        design = np.column_stack([t ** 2, t])
+        _quadratic_pseudo_inverses[n_days] = design, np.linalg.pinv(design)
+    return _quadratic_pseudo_inverses[n_days]
+
+
+def fit_quadratic_batch(close_prices):
+    """
+    This function fits fitfunc to the close prices of many tickers at once, by least squares, as leastsq does with
+    errfunc for one ticker. All the fits are a single product with the shared pseudo-inverse of the design matrix
+    :param close_prices: 2-D array of the close prices (tickers x days), or a 1-D array for a single ticker
+    :return: dict - With the parameters [p0, p1] of every ticker (tickers x 2), the residuals fitfunc - close price as
+    errfunc (tickers x days), and the R squared of every ticker. Tickers with a missing close price get NaN. The
+    quadratic has no intercept, so the R squared is the uncentered one, 1 - SSE / sum(y ** 2), which is between 0 and 1
+    as the fit is never worse than the zero line
+    """
+    close_prices = np.atleast_2d(np.asarray(close_prices, dtype=np.float64))
+    design, pseudo_inverse = quadratic_pseudo_inverse(close_prices.shape[1])
+    coefficients = np.dot(close_prices, pseudo_inverse.T)
+    residuals = np.dot(coefficients, design.T) - close_prices
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = 1.0 - (residuals ** 2).sum(axis=1) / (close_prices ** 2).sum(axis=1)
+    return {'coefficients': coefficients, 'residuals': residuals, 'r_squared': r_squared}
+
+
+def _rolling_moments(close_prices, window, powers):
     """
-    Plots best fitting quadratic equation
+    This function returns the sums of t ** m * y over every window of the close prices, for t = 1 .. window and every
+    power m, along with the sums of y ** 2. Rather than summing every window from scratch, they come from running
+    (cumulative) sums of i ** k * y over the days i, shifted to the start of every window with the binomial expansion
+    (i - c) ** m = sum_k C(m, k) * (-c) ** (m - k) * i ** k
+    :param close_prices: 2-D array of the close prices (tickers x days), with at least window days
+    :param window: The number of days in the window
+    :param powers: The powers of t in the model
+    :return: tuple - The sums of t ** m * y (tickers x windows x powers), and the sums of y ** 2 (tickers x windows)
+    """
+    n_tickers, n_days = close_prices.shape
+    days = np.arange(n_days, dtype=np.float64)
+
+    def window_sums(values):
+        running = np.concatenate([np.zeros((n_tickers, 1)), np.cumsum(values, axis=1)], axis=1)
+        return running[:, window:] - running[:, :-window]
+
+    sums = [window_sums(close_prices * days ** k) for k in xrange(max(powers) + 1)]
+    # The window ending on day e starts on day e - window + 1, where t = i - c = 1, so c = e - window
+    shift = -(np.arange(window - 1, n_days, dtype=np.float64) - window)
+    moments = np.empty((n_tickers, n_days - window + 1, len(powers)))
+    for column, power in enumerate(powers):
+        moments[:, :, column] = sum(scipy.special.comb(power, k, exact=True) * shift ** (power - k) * sums[k]
+                                    for k in xrange(power + 1))
+    return moments, window_sums(close_prices ** 2)
+
+
+def rolling_quadratic_fit(close_prices, window=21, powers=(2, 1), block=1024):
+    """
+    This function fits the quadratic of fitfunc over a window sliding along the close prices of many tickers, and
+    returns the fit of the window ending on every day. Within every window the time steps are t = 1 .. window, as in
+    fit_quadratic_batch. The normal equations of every window are solved from running sums updated day by day (see
+    _rolling_moments), which restart every block of days to keep the powers of the days, and the rounding errors, small
+    :param close_prices: 2-D array of the close prices (tickers x days), or a 1-D array for a single ticker
+    :param window: The number of days in the window, a month of trading days by default
+    :param powers: The powers of t in the model, (2, 1) for fitfunc, or for example (2, 1, 0) to add an intercept
+    :param block: The number of windows between restarts of the running sums
+    :return: dict - With the parameters of the window ending on every day (tickers x days x powers) and the root mean
+    squared error of its residuals (tickers x days), NaN for the first window - 1 days
+    """
+    close_prices = np.atleast_2d(np.asarray(close_prices, dtype=np.float64))
+    n_tickers, n_days = close_prices.shape
+    coefficients = np.full((n_tickers, n_days, len(powers)), np.nan)
+    rmse = np.full((n_tickers, n_days), np.nan)
+
+    # The normal equations share the same matrix in every window
+    t = np.arange(1, window + 1, dtype=np.float64)
+    design = np.column_stack([t ** power for power in powers])
+    gram = np.dot(design.T, design)
+    gram_inverse = np.linalg.inv(gram)
+    for start in xrange(0, n_days - window + 1, block):
+        days = slice(start, min(start + block + window - 1, n_days))
+        moments, squares = _rolling_moments(close_prices[:, days], window, powers)
+        fitted = np.dot(moments, gram_inverse.T)
+        residual_squares = squares - 2 * (fitted * moments).sum(axis=2) + (np.dot(fitted, gram) * fitted).sum(axis=2)
+        ends = slice(start + window - 1, days.stop)
+        coefficients[:, ends] = fitted
+        rmse[:, ends] = np.sqrt(np.maximum(residual_squares, 0.0) / window)
+    return {'coefficients': coefficients, 'rmse': rmse}
+
+
+def best_fit_with_plot(close_price, model='quadratic'):
+    """
+    Plots best fitting trend model, the quadratic equation by default
     :param close_price: The array to fit
+    :param model: The name of the trend model, see get_model
     :return: None
     """
     x_data = np.arange(1, len(close_price) + 1)
     y_data = close_price
 
-    guess = np.array([close_price.max(), close_price.min()])
-    output, preds = scipy.optimize.leastsq(errfunc, guess, args=(x_data, y_data))
-    y_error = fitfunc(output, x_data) - y_data  # residuals
+    if model == 'quadratic':
+        fit = fit_quadratic_batch(close_price)
+        fitted = fitfunc(fit['coefficients'][0], x_data)
+        label = "Best Fit - Quadratic Function"
+    else:
+        fitted = fit_model(get_model(model), close_price)['fitted']
+        label = "Best Fit - %s" % model
+    y_error = fitted - y_data  # residuals
     pylab.errorbar(x_data, y_data, yerr=y_error, fmt='ro', label="Actual stock price")
-    pylab.plot(fitfunc(output, x_data), 'b--', label="Best Fit - Quadratic Function")
+    pylab.plot(fitted, 'b--', label=label)
     pylab.legend(loc='best')
     pylab.show()
 
@@ -123,9 +467,6 @@ def main():
     """
     # Wrap in a try block so that we catch any exceptions thrown by other functions and return a 1 for graceful exit
     try:
-        # ===== Step 0: Sanitation =====
-        # Fix Pandas Datareader's Issues with Yahoo Finance (Since yahoo abandoned it's API)
-        yahoo_finance_bridge()
 
         # ===== Step 1: Get the Ticker From user =====
         # Prompt the user to input the data that needs to be downloaded
@@ -0,0 +1,110 @@
+"""
+@author: Osama Iqbal
+
+Code uses Python 2.7, packaged with Anaconda 4.4.0
+
+Benchmark of the trend models of Mini Project 1: every model is fitted with leastsq to the close prices of synthetic
+stocks, once estimating the Jacobian by finite differences and once with the analytic Jacobian of the model. The
+quadratic is also fitted through errfunc, as best_fit_with_plot used to, and with the batch solve of
+fit_quadratic_batch. The number of evaluations of the model (and of its Jacobian) and the time per fit are compared.
+
+Usage: python benchmark_models.py [number of stocks] [number of days]
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import sys  # For gracefully notifying whether the script has ended or not
+import time  # For timing the fits
+import numpy as np  # For numerical operations
+import scipy.optimize  # For fitting through errfunc
+
+import OsamaIqbal_MiniProject1 as mp1  # The trend models of Mini Project 1
+import market_data  # Shared market data layer, made importable by Mini Project 1
+
+
+def fit_with_errfunc(close_price):
+    """
+    This function fits fitfunc to the close prices through errfunc, as best_fit_with_plot used to
+    :param close_price: The array to fit
+    :return: dict - With the number of evaluations of errfunc, and no evaluations of a Jacobian
+    """
+    x_data = np.arange(1, len(close_price) + 1)
+    guess = np.array([close_price.max(), close_price.min()])
+    info = scipy.optimize.leastsq(mp1.errfunc, guess, args=(x_data, close_price), full_output=True)[2]
+    return {'evaluations': info['nfev'], 'jacobian_evaluations': 0}
+
+
+def benchmark_fits(name, fit, close_prices):
+    """
+    This function fits every series of close prices, and measures the evaluations and the time it takes
+    :param name: The name of the fit
+    :param fit: The function fitting a single series, returning a dict like fit_model
+    :param close_prices: 2-D array of the close prices (stocks x days)
+    :return: tuple - The name, the mean number of evaluations of the model and of its Jacobian, and the mean time per
+    fit in milliseconds
+    """
+    start = time.time()
+    fits = [fit(close_price) for close_price in close_prices]
+    elapsed = time.time() - start
+    return (name, np.mean([result['evaluations'] for result in fits]),
+            np.mean([result['jacobian_evaluations'] for result in fits]), elapsed / len(close_prices) * 1000)
+
+
+def benchmark(n_stocks=1000, n_days=21, seed=0):
+    """
+    This function times every way of fitting every trend model on the close prices of synthetic stocks
+    :param n_stocks: The number of stocks
+    :param n_days: The number of trading days, a month by default
+    :param seed: The seed of the random number generator
+    :return: list - Tuples of the fit, the mean number of evaluations of the model and of its Jacobian, and the mean
+    time per fit in milliseconds
+    """
+    close_prices = market_data.synthetic_close_prices(n_stocks, n_days, seed=seed).values.T
+    results = [benchmark_fits('quadratic, errfunc', fit_with_errfunc, close_prices)]
+    for name in ['quadratic', 'polynomial:1', 'polynomial:3', 'exponential', 'log-linear']:
+        model = mp1.get_model(name)
+        results.append(benchmark_fits('%s, finite differences' % name,
+                                      lambda close_price: mp1.fit_model(model, close_price, False), close_prices))
+        results.append(benchmark_fits('%s, analytic Jacobian' % name,
+                                      lambda close_price: mp1.fit_model(model, close_price), close_prices))
+
+    start = time.time()
+    mp1.fit_quadratic_batch(close_prices)
+    results.append(('quadratic, batch solve', 0, 0, (time.time() - start) / n_stocks * 1000))
+    return results
+
+
+def main():
+    """
+    This function is called from the main block. The purpose of this function is to contain all the calls to
+    business logic functions
+    :return: int - Return 0 or 1, which is used as the exist code, depending on successful or erroneous flow
+    """
+    # Wrap in a try block so that we catch any exceptions thrown by other functions and return a 1 for graceful exit
+    try:
+        arguments = [int(arg) for arg in sys.argv[1:3]]
+        n_stocks = arguments[0] if len(arguments) > 0 else 1000
+        n_days = arguments[1] if len(arguments) > 1 else 21
+        print('%d stocks, %d days\n' % (n_stocks, n_days))
+        print('%-40s %12s %12s %12s' % ('Fit', 'Evaluations', 'Jacobians', 'ms per fit'))
+        for name, evaluations, jacobian_evaluations, elapsed in benchmark(n_stocks, n_days):
+            print('%-40s %12.2f %12.2f %12.4f' % (name, evaluations, jacobian_evaluations, elapsed))
+
+    except BaseException, e:
+        # Casting a wide net to catch all exceptions
+        print('\n%s' % str(e))
+        return 1
+
+
+# Main block of the program. The program begins execution from this block when called from a cmd
+if __name__ == '__main__':
+    # Initialize Logger
+    logging.basicConfig(format='%(asctime)s %(message)s: ')
+    logging.info('Application Started')
+    exit_code = main()
+    logging.info('Application Ended')
+    sys.exit(exit_code)
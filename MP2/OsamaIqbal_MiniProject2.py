@@ -22,25 +22,14 @@ __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
 import sys  # For gracefully notifying whether the script has ended or not
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
 import pandas as pd  # For calculating coefficient of correlation
-import warnings  # For removing Deprecation Warning w.r.t. Yahoo Finance Fix
+import numpy as np  # For calculating the correlation matrix of many indices at once
 import datetime  # For setting correct dates from today up to a year in the past to get data from YF
-import time
 import seaborn as sns  # For plotting the graphs
 
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
-
-
-def yahoo_finance_bridge():
-    """
-        This function fixes problems w.r.t. fetching data from Yahoo Finance
-        :return: None
-        """
-    logging.info('Correcting Yahoo Finance')
-    pdr_override()
+import os  # For locating the shared market data module
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import market_data  # Shared on-disk cache of the market data, in the root of the repository
 
 
 def get_countries_from_user():
@@ -105,34 +94,220 @@ def get_market_names_from_countries(countries):
         return markets_from_countries
 
 
-def get_data_from_yahoo_finance(market_ticker):
+def get_data_from_yahoo_finance(market_tickers):
     """
-    This function fetches data from Yahoo Finance in the form of a Pandas DataFrame
-    :param market_ticker: The Ticker symbol for which data needs to be fetched
-    :return: pd.DataFrame - Returns a DataFrame containing the data fetched from Yahoo Finance
+    This function fetches data from Yahoo Finance in the form of Pandas DataFrames, downloading all the tickers at
+    the same time. Yahoo Finance sometimes bugs out, so the failed requests are retried, at a limited rate
+    :param market_tickers: The Ticker symbols for which data needs to be fetched
+    :return: dict - Mapping of the tickers to DataFrames containing the data fetched from Yahoo Finance
     """
     today = datetime.datetime.now().date()
     ten_years_ago = today.replace(year=today.year - 10)
-    time.sleep(2)
-    data = pdr.get_data_yahoo(market_ticker, start=str(ten_years_ago), end=str(today), auto_adjust=True)
-    if data.empty:
-        logging.info('No Data found for Ticker %s. The ticker does not exist' % market_ticker)
-        raise ValueError('No Data found for Ticker %s. The ticker does not exist' % market_ticker)
-    else:
-        return data
+    # All the indices are requested at once, and only the retries are spaced out by the rate limit
+    data = market_data.get_histories(market_tickers, ten_years_ago, today, max_workers=len(market_tickers), rate=1.0,
+                                     burst=len(market_tickers))
+    for market_ticker in market_tickers:
+        if data[market_ticker].empty:
+            logging.info('No Data found for Ticker %s. The ticker does not exist' % market_ticker)
+            raise ValueError('No Data found for Ticker %s. The ticker does not exist' % market_ticker)
+    return data
 
 
-def get_monthly_return(index):
+def get_monthly_returns(indices):
     """
-    Calculate the Monthly Return of the data based on Monthly Return calculations given at:
-    (http://bit.ly/2hHNHuV)
-    :param index: The index whose monthly return needs to be calculated
-    :return: pd.DataFrame: Consisting of values with the monthly return
+    Calculate the Monthly Returns of many indices at once, based on Monthly Return calculations given at:
+    (http://bit.ly/2hHNHuV). The indices are aligned on their dates first, so that markets with different trading
+    calendars and holidays are compared month by month
+    :param indices: dict - Mapping of the tickers to DataFrames containing their data, with a Close column
+    :return: pd.DataFrame: Consisting of the monthly returns, one column per ticker, indexed by the month end
     """
-    monthly = index.asfreq('M').ffill()
+    closes = pd.concat(dict((ticker, index['Close']) for ticker, index in indices.items()), axis=1)
+    # The last close of every month, for every index in a single resample
+    monthly = closes.resample('M').last()
     monthly_pc = monthly / monthly.shift(1) - 1
-    # Drop na rows and return
-    return monthly_pc.dropna()
+    # Drop the rows without any return
+    return monthly_pc.dropna(how='all')
+
+
+def _center_returns(returns):
+    """
+    This function prepares the returns for summing over pairs. Centering by the mean does not change the
+    correlations, but keeps the sums of squares accurate
+    :param returns: pd.DataFrame - The returns, one column per ticker
+    :return: tuple - The centered returns with 0 for the missing values, and the mask of the present values, as floats
+    """
+    values = returns.values.astype(np.float64)
+    present = ~np.isnan(values)
+    return np.where(present, values - np.nanmean(values, axis=0), 0.0), present.astype(np.float64)
+
+
+def _correlation_from_sums(count, sums, squares, products, observations, min_periods):
+    """
+    This function calculates the Pearson Correlation Coefficients from the sums over the rows where both columns of
+    every pair have a return, where sums[i, j] is the sum of the returns of i and squares[i, j] the sum of their squares
+    :param count: The (weighted) number of returns of every pair
+    :param sums: The sums of the returns of the first ticker of every pair
+    :param squares: The sums of the squared returns of the first ticker of every pair
+    :param products: The sums of the products of the returns of every pair
+    :param observations: The number of returns of every pair, to check against min_periods
+    :param min_periods: The smallest number of returns that a pair needs in common to have a correlation
+    :return: np.ndarray - The correlation matrix, NaN for the pairs with less than min_periods returns in common
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = products - sums * sums.T / count
+        variance = squares - sums ** 2 / count
+        correl = covariance / np.sqrt(variance * variance.T)
+    correl[observations < max(min_periods, 2)] = np.nan
+    return np.clip(correl, -1.0, 1.0)
+
+
+def correlation_matrix(returns, min_periods=1):
+    """
+    This function calculates the Pearson Correlation Coefficients between every pair of columns in one pass, the same
+    as returns.corr(method='pearson', min_periods=min_periods), with the missing values of every pair left out. All
+    the sums of the pairs are computed with matrix products over the masked returns, so that it scales to hundreds of
+    indices or stocks
+    :param returns: pd.DataFrame - The returns, one column per ticker
+    :param min_periods: The smallest number of returns that a pair needs in common to have a correlation
+    :return: pd.DataFrame - The correlation matrix, NaN for the pairs with less than min_periods returns in common
+    """
+    centered, mask = _center_returns(returns)
+    # count[i, j], sums[i, j] and squares[i, j] are over the rows where both i and j have a return
+    count = np.dot(mask.T, mask)
+    correl = _correlation_from_sums(count, np.dot(centered.T, mask), np.dot((centered ** 2).T, mask),
+                                    np.dot(centered.T, centered), count, min_periods)
+    return pd.DataFrame(correl, index=returns.columns, columns=returns.columns)
+
+
+def blocked_correlation(returns, block_size=1024, min_periods=1, filename=None, dtype=np.float32):
+    """
+    This function calculates the Pearson correlation matrix of a large universe tile by tile, so that only one
+    block_size x block_size tile of intermediate results is in memory at a time, and writes every tile straight to the
+    output, which can be memory-mapped to disk. When no returns are missing, the returns are standardized once and
+    every tile is a single matrix product. Otherwise the missing values of every pair are left out, the same as
+    correlation_matrix
+    :param returns: pd.DataFrame - The returns, one column per ticker
+    :param block_size: The number of tickers in every tile
+    :param min_periods: The smallest number of returns that a pair needs in common to have a correlation
+    :param filename: The .npy file to memory-map the output to, or None to keep it in memory
+    :param dtype: The data type of the products and the output, np.float32 halves the memory and doubles the speed
+    :return: np.ndarray - The (tickers x tickers) correlation matrix, following returns.columns
+    """
+    centered, mask = _center_returns(returns)
+    n = centered.shape[1]
+    if filename is None:
+        correl = np.empty((n, n), dtype=dtype)
+    else:
+        correl = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(n, n))
+    complete = mask.all()
+    if complete:
+        # Standardize once, so that every tile of the correlation matrix is a product of two blocks of columns
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centered = (centered / np.sqrt((centered ** 2).sum(axis=0))).astype(dtype)
+    else:
+        centered, mask = centered.astype(dtype), mask.astype(dtype)
+    for first in xrange(0, n, block_size):
+        rows = slice(first, min(first + block_size, n))
+        # The matrix is symmetric, so only the tiles on and above the diagonal are computed
+        for second in xrange(first, n, block_size):
+            columns = slice(second, min(second + block_size, n))
+            if complete:
+                tile = np.dot(centered[:, rows].T, centered[:, columns])
+                if len(centered) < max(min_periods, 2):
+                    tile[:] = np.nan
+                tile = np.clip(tile, -1.0, 1.0)
+            else:
+                count = np.dot(mask[:, rows].T, mask[:, columns]).astype(np.float64)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    sums_rows = np.dot(centered[:, rows].T, mask[:, columns]) / count
+                    sums_columns = np.dot(mask[:, rows].T, centered[:, columns]) / count
+                    covariance = np.dot(centered[:, rows].T, centered[:, columns]) - count * sums_rows * sums_columns
+                    variance_rows = np.dot((centered[:, rows] ** 2).T, mask[:, columns]) - count * sums_rows ** 2
+                    variance_columns = np.dot(mask[:, rows].T, centered[:, columns] ** 2) - count * sums_columns ** 2
+                    tile = np.clip(covariance / np.sqrt(variance_rows * variance_columns), -1.0, 1.0)
+                tile[count < max(min_periods, 2)] = np.nan
+            correl[rows, columns] = tile
+            correl[columns, rows] = tile.T
+    if filename is not None:
+        correl.flush()
+    return correl
+
+
+def _running_correlation(returns, window, decay, min_periods, filename, dtype):
+    """
+    This function calculates a correlation matrix for every row of the returns, updating the sums of the pairs as
+    every row enters the window (and leaves it, for a rolling window) instead of recomputing them from scratch
+    :param returns: pd.DataFrame - The returns, one column per ticker
+    :param window: The number of rows in the rolling window, or None to keep every row
+    :param decay: The factor that the weight of every earlier row is multiplied by on every row, 1 for equal weights
+    :param min_periods: The smallest number of returns that a pair needs in common to have a correlation
+    :param filename: The .npy file to memory-map the output to, or None to keep it in memory
+    :param dtype: The data type of the output
+    :return: np.ndarray - Array of shape (time, tickers, tickers) containing the correlation matrices
+    """
+    centered, mask = _center_returns(returns)
+    steps, n = centered.shape
+    if filename is None:
+        correls = np.empty((steps, n, n), dtype=dtype)
+    else:
+        correls = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(steps, n, n))
+    observations = np.zeros((n, n))
+    count = np.zeros((n, n))
+    sums = np.zeros((n, n))
+    squares = np.zeros((n, n))
+    products = np.zeros((n, n))
+    for step in xrange(steps):
+        if decay != 1.0:
+            for total in (count, sums, squares, products):
+                total *= decay
+        x, m = centered[step], mask[step]
+        observations += np.outer(m, m)
+        count += np.outer(m, m)
+        sums += np.outer(x, m)
+        squares += np.outer(x ** 2, m)
+        products += np.outer(x, x)
+        if window is not None and step >= window:
+            # The row leaving the window, which has its full weight as the rolling window does not decay
+            x, m = centered[step - window], mask[step - window]
+            observations -= np.outer(m, m)
+            count -= np.outer(m, m)
+            sums -= np.outer(x, m)
+            squares -= np.outer(x ** 2, m)
+            products -= np.outer(x, x)
+        correls[step] = _correlation_from_sums(count, sums, squares, products, observations, min_periods)
+    if filename is not None:
+        correls.flush()
+    return correls
+
+
+def rolling_correlation(returns, window=36, min_periods=None, filename=None, dtype=np.float64):
+    """
+    This function calculates the correlation matrix of the returns over a rolling window ending on every row, the same
+    as returns.rolling(window, min_periods).corr(), but incrementally from running sums and as a compact array
+    :param returns: pd.DataFrame - The returns, one column per ticker
+    :param window: The number of rows in the rolling window, e.g. 36 months
+    :param min_periods: The smallest number of returns that a pair needs in common in the window, defaults to window
+    :param filename: The .npy file to memory-map the output to (for large universes), or None to keep it in memory
+    :param dtype: The data type of the output, np.float32 halves its size
+    :return: np.ndarray - Array of shape (len(returns), tickers, tickers), following returns.index and returns.columns
+    """
+    if min_periods is None:
+        min_periods = window
+    return _running_correlation(returns, window, 1.0, min_periods, filename, dtype)
+
+
+def ewma_correlation(returns, halflife=12, min_periods=1, filename=None, dtype=np.float64):
+    """
+    This function calculates the exponentially weighted correlation matrix of the returns up to every row, the same
+    as returns.ewm(halflife=halflife).corr() when no returns are missing, updating decayed running sums on every row
+    :param returns: pd.DataFrame - The returns, one column per ticker
+    :param halflife: The number of rows after which the weight of a return halves
+    :param min_periods: The smallest number of returns that a pair needs in common
+    :param filename: The .npy file to memory-map the output to (for large universes), or None to keep it in memory
+    :param dtype: The data type of the output, np.float32 halves its size
+    :return: np.ndarray - Array of shape (len(returns), tickers, tickers), following returns.index and returns.columns
+    """
+    return _running_correlation(returns, None, 0.5 ** (1.0 / halflife), min_periods, filename, dtype)
 
 
 def main():
@@ -143,9 +318,6 @@ def main():
     """
     # Wrap in a try block so that we catch any exceptions thrown by other functions and return a 1 for graceful exit
     try:
-        # ===== Step 0: Sanitation =====
-        # Fix Pandas Datareader's Issues with Yahoo Finance (Since yahoo abandoned it's API)
-        yahoo_finance_bridge()
         # ===== Step 1: Get the two markets from the user =====
         # Prompt the user to input the data that needs to be downloaded
         countries = get_countries_from_user()
@@ -154,58 +326,43 @@ def main():
         markets_to_load = get_market_names_from_countries(countries)
 
         # ===== Step 3: Download the 10 Year data for the Ticker =====
-        indices_to_load_list = list(markets_to_load.values())
-        index_one = get_data_from_yahoo_finance(str(indices_to_load_list[0]))
-        index_two = get_data_from_yahoo_finance(str(indices_to_load_list[1]))
+        indices_to_load_list = [str(index) for index in markets_to_load.values()]
+        # The remaining indices are needed for the additional step, so download all of them at the same time
+        other_indices_to_load = [str(val) for val in get_market_map().values() if val not in indices_to_load_list]
+        indices = get_data_from_yahoo_finance(indices_to_load_list + other_indices_to_load)
+        index_one = indices[indices_to_load_list[0]]
+        index_two = indices[indices_to_load_list[1]]
 
         # ===== Step 4: Calculate Correlation Coefficients of monthly returns between each pair of indices =====
-        # Get monthly returns for the indices
-        monthly_return_index_one = get_monthly_return(index_one)
-        monthly_return_index_two = get_monthly_return(index_two)
-        # Combine the monthly returns into a single DataFrame
-        monthly_return_combo = pd.DataFrame({indices_to_load_list[0]: monthly_return_index_one['Close'].tolist(),
-                                             indices_to_load_list[1]: monthly_return_index_two['Close'].tolist()})
-        # Convert Decimal Values to percentage values
-        monthly_return_combo = monthly_return_combo * 100
-        # Calculate the correlation
-        correl = monthly_return_combo.corr(method='pearson', min_periods=1)
+        # Get monthly returns for all the indices, as percentage values, with the two chosen markets first
+        monthly_return_combo = get_monthly_returns(indices)[indices_to_load_list + other_indices_to_load] * 100
+        # Calculate the correlation between all the indices, and pick out the two markets from it
+        total_correl = correlation_matrix(monthly_return_combo, min_periods=1)
+        correl = total_correl.loc[indices_to_load_list, indices_to_load_list]
 
         # ===== Step 5: Plot the results in a suitable graphical format =====
         sns.heatmap(correl,
                     xticklabels=correl.columns.values,
                     yticklabels=correl.columns.values)
         sns.plt.show()
-        sns.pairplot(monthly_return_combo)
+        sns.pairplot(monthly_return_combo[indices_to_load_list].dropna())
         sns.plt.show()
 
-        # ===== Additional Step: Calculate Correl between all the indices =====
-        # Get the rest of the indices that are pending
-        other_indices_to_load = [val for val in get_market_map().values() if val not in indices_to_load_list]
-
-        index_three = get_data_from_yahoo_finance(str(other_indices_to_load[0]))
-        index_four = get_data_from_yahoo_finance(str(other_indices_to_load[1]))
-        index_five = get_data_from_yahoo_finance(str(other_indices_to_load[2]))
-
-        monthly_return_index_three = get_monthly_return(index_three)
-        monthly_return_index_four = get_monthly_return(index_four)
-        monthly_return_index_five = get_monthly_return(index_five)
-
-        other_monthly_return_combo = pd.DataFrame({
-            other_indices_to_load[0]: monthly_return_index_three['Close'].tolist(),
-            other_indices_to_load[1]: monthly_return_index_four['Close'].tolist(),
-            other_indices_to_load[2]: monthly_return_index_five['Close'].tolist()})
-
-        other_monthly_return_combo = other_monthly_return_combo * 100
-
-        total_combo = pd.concat([monthly_return_combo, other_monthly_return_combo], axis=1)
-
-        total_correl = total_combo.corr(method='pearson', min_periods=1)
-
+        # ===== Additional Step: Plot the Correl between all the indices =====
         sns.heatmap(total_correl,
                     xticklabels=total_correl.columns.values,
                     yticklabels=total_correl.columns.values)
         sns.plt.show()
-        sns.pairplot(total_combo)
+        sns.pairplot(monthly_return_combo.dropna())
+        sns.plt.show()
+
+        # ===== Additional Step: Plot how the Correl between the two markets changes over time =====
+        rolling_correl = rolling_correlation(monthly_return_combo, window=36)
+        ewma_correl = ewma_correlation(monthly_return_combo, halflife=12, min_periods=12)
+        correl_over_time = pd.DataFrame({'Rolling 36 Months': rolling_correl[:, 0, 1],
+                                         'EWMA Halflife 12 Months': ewma_correl[:, 0, 1]},
+                                        index=monthly_return_combo.index)
+        correl_over_time.plot(title='Correlation between %s and %s' % tuple(indices_to_load_list))
         sns.plt.show()
 
     except BaseException, e:
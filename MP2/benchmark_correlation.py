@@ -0,0 +1,90 @@
+"""
+@author: Osama Iqbal
+
+Code uses Python 2.7, packaged with Anaconda 4.4.0
+
+Benchmark of the correlation matrix of a large universe of stocks: the DataFrame.corr() path that Mini Project 2 used,
+against correlation_matrix and blocked_correlation in float64 and float32. Every method is timed on the daily returns
+of synthetic stocks, and compared against DataFrame.corr() for accuracy.
+
+Usage: python benchmark_correlation.py [number of stocks ...]
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import sys  # For gracefully notifying whether the script has ended or not
+import time  # For timing the correlation methods
+import numpy as np  # For comparing the correlation matrices
+
+import OsamaIqbal_MiniProject2 as mp2  # The correlation methods of Mini Project 2
+import market_data  # Shared market data layer, made importable by Mini Project 2
+
+
+def time_method(method):
+    """
+    This function calls a method and measures how long it takes
+    :param method: The method to call, without arguments
+    :return: tuple - The result of the method, and the time it took in seconds
+    """
+    start = time.time()
+    result = method()
+    return result, time.time() - start
+
+
+def benchmark(n_stocks, n_days=2520, missing=0.01, seed=0):
+    """
+    This function times every correlation method on the daily returns of synthetic stocks, some of them missing
+    :param n_stocks: The number of stocks
+    :param n_days: The number of trading days, 10 years by default
+    :param missing: The share of returns that are missing, as with trading holidays or stocks listed later
+    :param seed: The seed of the random number generator
+    :return: list - Tuples of the method, its time in seconds and its largest error against DataFrame.corr()
+    """
+    returns = market_data.synthetic_close_prices(n_stocks, n_days + 1, seed=seed).pct_change().iloc[1:]
+    returns = returns.mask(np.random.RandomState(seed).uniform(size=returns.shape) < missing)
+
+    expected, expected_time = time_method(lambda: returns.corr(method='pearson', min_periods=1).values)
+    results = [('DataFrame.corr', expected_time, 0.0)]
+    methods = [('correlation_matrix', lambda: mp2.correlation_matrix(returns).values),
+               ('blocked_correlation float64', lambda: mp2.blocked_correlation(returns, dtype=np.float64)),
+               ('blocked_correlation float32', lambda: mp2.blocked_correlation(returns, dtype=np.float32))]
+    for name, method in methods:
+        correl, elapsed = time_method(method)
+        results.append((name, elapsed, np.nanmax(np.abs(correl - expected))))
+    return results
+
+
+def main():
+    """
+    This function is called from the main block. The purpose of this function is to contain all the calls to
+    business logic functions
+    :return: int - Return 0 or 1, which is used as the exist code, depending on successful or erroneous flow
+    """
+    # Wrap in a try block so that we catch any exceptions thrown by other functions and return a 1 for graceful exit
+    try:
+        universe_sizes = [int(arg) for arg in sys.argv[1:]] or [100, 500, 1000]
+        for n_stocks in universe_sizes:
+            # Complete returns take the standardized path of blocked_correlation, missing ones the pairwise path
+            for missing in [0.0, 0.01]:
+                print('\n%d stocks, %.0f%% of the returns missing' % (n_stocks, missing * 100))
+                for name, elapsed, error in benchmark(n_stocks, missing=missing):
+                    print('%-30s %10.3f s    largest error %.2e' % (name, elapsed, error))
+
+    except BaseException, e:
+        # Casting a wide net to catch all exceptions
+        print('\n%s' % str(e))
+        return 1
+
+
+# Main block of the program. The program begins execution from this block when called from a cmd
+if __name__ == '__main__':
+    # Initialize Logger
+    logging.basicConfig(format='%(asctime)s %(message)s: ')
+    logging.info('Application Started')
+    exit_code = main()
+    logging.info('Application Ended')
+    sys.exit(exit_code)
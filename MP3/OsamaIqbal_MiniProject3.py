@@ -24,9 +24,675 @@ __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 import logging  # Logging class for logging in the case of an error, makes debugging easier
 import sys  # For gracefully notifying whether the script has ended or not
 import os  # For joining of paths
+import io  # For reading the JSON file line by line
+import json  # For parsing the food records of the JSON file
+import hashlib  # For fingerprinting the food records of the JSON file
+import cPickle  # For storing the aggregates of the incremental analysis
+from array import array  # For compact columns of numbers while parsing
+import multiprocessing  # For drawing the charts of the nutrient profile in parallel
+import numpy as np  # For building the columns of the tables
 import pandas as pd  # For calculating coefficient of correlation
 import seaborn as sns  # For plotting the graphs
 
+# The USDA National Nutrient Database, converted to JSON by nutrient-db
+NUTRIENTS_JSON = os.path.join('nutrient-db', 'nutrients.json')
+
+# List of Amino Acids - From Wikipedia (https://en.wikipedia.org/wiki/Amino_acid#Table_of_standard_amino_acid_abbreviations_and_properties)
+AMINO_ACIDS = ["Alanine", "Arginine", "Asparagine", "Aspartic acid", "Cysteine", "Glutamic acid", "Glutamine",
+               "Glycine", "Histidine", "Isoleucine", "Leucine", "Lysine", "Methionine", "Phenylalanine", "Proline",
+               "Serine", "Threonine", "Tryptophan", "Tyrosine", "Valine"]
+
+# The name of Zinc in the nutrients
+ZINC = u'Zinc, Zn'
+
+# The string columns of the nutrients table that repeat the same few values, stored as categoricals
+CATEGORICAL_COLUMNS = ['group', 'nutrient_group', 'nutrient', 'units']
+
+
+def _intern(categories, value):
+    """
+    This function returns the code of a string in a categorical column, adding it to the categories when it is new
+    :param categories: dict - Mapping of the strings of the column seen so far to their codes
+    :param value: The string
+    :return: int - The code of the string
+    """
+    code = categories.get(value)
+    if code is None:
+        code = categories[value] = len(categories)
+    return code
+
+
+def _categorical(codes, categories):
+    """
+    This function builds a categorical column out of the codes of its strings
+    :param codes: array - The codes of the strings in the column
+    :param categories: dict - Mapping of the strings of the column to their codes
+    :return: pd.Categorical - The column
+    """
+    names = [None] * len(categories)
+    for name, code in categories.items():
+        names[code] = name
+    column = pd.Categorical.from_codes(np.array(codes, dtype=np.int32), names)
+    # Sorted the same as the categoricals of the stored tables
+    return column.reorder_categories(sorted(names))
+
+
+def parse_nutrients_json(path=NUTRIENTS_JSON, progress=None):
+    """
+    This function parses the JSON file of nutrient-db one food record (line) at a time, and flattens it into a table
+    of the foods and a long table of their nutrients. Only one food record is held as Python objects at a time, and
+    the repeating strings are interned into categorical columns
+    :param path: The path of the JSON file written by nutrientdb.py -e
+    :param progress: Optional function called with the number of bytes parsed and the size of the file, every 1000 foods
+    :return: tuple - pd.DataFrame of the foods (id, name, group, manufacturer), and pd.DataFrame of the nutrients
+    (food_id, group, nutrient_group, nutrient, value, units) with one row for every nutrient of every food
+    """
+    food_ids, food_names, food_groups, manufacturers = array('l'), [], array('i'), []
+    nutrient_food_ids, nutrient_food_groups, values = array('l'), array('i'), array('d')
+    nutrient_groups, nutrient_names, units = array('i'), array('i'), array('i')
+    categories = dict((column, {}) for column in CATEGORICAL_COLUMNS)
+
+    size = os.path.getsize(path)
+    parsed = 0
+    with io.open(path, 'rb') as json_file:
+        for line in json_file:
+            parsed += len(line)
+            if not line.strip():
+                continue
+            if progress is not None and len(food_ids) % 1000 == 0:
+                progress(parsed, size)
+            food = json.loads(line.decode('utf-8'))
+            food_id = int(food['id'])
+            group = _intern(categories['group'], food.get('group') or u'')
+            food_ids.append(food_id)
+            food_names.append(food['name']['long'])
+            food_groups.append(group)
+            manufacturers.append(food.get('manufacturer') or u'')
+            for nutrient in food.get('nutrients') or []:
+                value = nutrient.get('value')
+                nutrient_food_ids.append(food_id)
+                nutrient_food_groups.append(group)
+                nutrient_groups.append(_intern(categories['nutrient_group'], nutrient.get('group') or u''))
+                nutrient_names.append(_intern(categories['nutrient'], nutrient['name']))
+                values.append(np.nan if value is None else float(value))
+                units.append(_intern(categories['units'], nutrient.get('units') or u''))
+    if progress is not None:
+        progress(size, size)
+
+    foods = pd.DataFrame({'id': np.array(food_ids, dtype=np.int64),
+                          'name': food_names,
+                          'group': _categorical(food_groups, categories['group']),
+                          'manufacturer': manufacturers},
+                         columns=['id', 'name', 'group', 'manufacturer'])
+    nutrients = pd.DataFrame({'food_id': np.array(nutrient_food_ids, dtype=np.int64),
+                              'group': _categorical(nutrient_food_groups, categories['group']),
+                              'nutrient_group': _categorical(nutrient_groups, categories['nutrient_group']),
+                              'nutrient': _categorical(nutrient_names, categories['nutrient']),
+                              'value': np.array(values, dtype=np.float64),
+                              'units': _categorical(units, categories['units'])},
+                             columns=['food_id', 'group', 'nutrient_group', 'nutrient', 'value', 'units'])
+    return foods, nutrients
+
+
+def _table_paths(path):
+    """
+    This function returns the paths of the columnar (Parquet) files of the foods and nutrients tables, next to the
+    JSON file
+    :param path: The path of the JSON file
+    :return: tuple - The paths of the foods and the nutrients tables
+    """
+    base = os.path.splitext(path)[0]
+    return base + '.foods.parquet', base + '.nutrients.parquet'
+
+
+def _as_objects(table):
+    """
+    This function converts the categorical columns of a table to plain strings, which every Parquet version can store
+    :param table: pd.DataFrame - The table
+    :return: pd.DataFrame - A copy of the table without categorical columns
+    """
+    table = table.copy()
+    for column in table.columns:
+        if hasattr(table[column], 'cat'):
+            table[column] = table[column].astype(object)
+    return table
+
+
+def load_nutrients(path=NUTRIENTS_JSON, rebuild=False, progress=None):
+    """
+    This function returns the foods and nutrients tables of the JSON file of nutrient-db. The first run parses the
+    JSON file and stores the tables as columnar (Parquet) files next to it, later runs load those instead, until the
+    JSON file is regenerated
+    :param path: The path of the JSON file written by nutrientdb.py -e
+    :param rebuild: Whether to parse the JSON file even if the stored tables are up to date
+    :param progress: Optional function called with the number of bytes parsed and the size of the file, while parsing
+    :return: tuple - pd.DataFrame of the foods and pd.DataFrame of the nutrients, as returned by parse_nutrients_json
+    """
+    foods_path, nutrients_path = _table_paths(path)
+    stored = os.path.exists(foods_path) and os.path.exists(nutrients_path)
+    if not rebuild and stored and min(os.path.getmtime(foods_path),
+                                      os.path.getmtime(nutrients_path)) >= os.path.getmtime(path):
+        foods = pd.read_parquet(foods_path)
+        nutrients = pd.read_parquet(nutrients_path)
+        foods['group'] = foods['group'].astype('category')
+        for column in CATEGORICAL_COLUMNS:
+            nutrients[column] = nutrients[column].astype('category')
+        return foods, nutrients
+
+    logging.info('Parsing %s' % path)
+    foods, nutrients = parse_nutrients_json(path, progress)
+    _as_objects(foods).to_parquet(foods_path)
+    _as_objects(nutrients).to_parquet(nutrients_path)
+    return foods, nutrients
+
+
+def amino_acid_foods(foods, nutrients, amino_acids=None):
+    """
+    This function returns the foods in which every amino acid is present, as a table with one column per amino acid
+    listing the names of its foods in the order of the database. It is computed as one filter, de-duplication and
+    pivot over the nutrients table
+    :param foods: pd.DataFrame - The foods table, as returned by load_nutrients
+    :param nutrients: pd.DataFrame - The nutrients table, as returned by load_nutrients
+    :param amino_acids: The names of the amino acids, defaults to AMINO_ACIDS
+    :return: pd.DataFrame - Table with a column for every amino acid, padded with None below its last food
+    """
+    if amino_acids is None:
+        amino_acids = AMINO_ACIDS
+    present = nutrients.loc[nutrients['nutrient'].isin(amino_acids), ['food_id', 'nutrient']]
+    present = pd.DataFrame({'nutrient': present['nutrient'].astype(object).values,
+                            'name': foods.set_index('id')['name'].reindex(present['food_id']).values})
+    # Foods with the same name are listed once for every amino acid
+    present = present.drop_duplicates()
+    present['position'] = present.groupby('nutrient').cumcount()
+    table = present.pivot(index='position', columns='nutrient', values='name').reindex(columns=amino_acids)
+    table.index.name = table.columns.name = None
+    return table.where(table.notnull(), None)
+
+
+def median_by_group(nutrients, nutrient=ZINC):
+    """
+    This function calculates the median content of one nutrient in the foods of every food group, in a single groupby
+    :param nutrients: pd.DataFrame - The nutrients table, as returned by load_nutrients
+    :param nutrient: The name of the nutrient
+    :return: pd.Series - The median of the nutrient for every food group that has it, sorted by the food group
+    """
+    values = nutrients.loc[nutrients['nutrient'] == nutrient, ['group', 'value']]
+    return values.groupby(values['group'].astype(object))['value'].median().sort_index()
+
+
+def nutrient_profile(foods, nutrients, quantiles=(0.25, 0.75)):
+    """
+    This function calculates the statistics of every nutrient in every food group in a single grouped aggregation:
+    the values are sorted by (nutrient, food group) once, and the count, mean, median and quantiles of every pair are
+    read off the sorted values together. The coverage is the share of the foods of the group that have the nutrient
+    :param foods: pd.DataFrame - The foods table, as returned by load_nutrients
+    :param nutrients: pd.DataFrame - The nutrients table, as returned by load_nutrients
+    :param quantiles: The quantiles to calculate besides the median, between 0 and 1
+    :return: pd.DataFrame - The count, coverage, mean, median and quantiles (columns) of every nutrient and food group
+    that has it (rows, indexed by nutrient and group)
+    """
+    group_names = np.array(foods['group'].cat.categories, dtype=object)
+    n_groups = len(group_names)
+    # The food groups of the nutrients table may have been categorized on their own, so match them by name
+    group_codes = np.searchsorted(group_names.astype(np.unicode_),
+                                  np.array(nutrients['group'].cat.categories, dtype=np.unicode_))
+    group_codes = group_codes[nutrients['group'].cat.codes.values]
+    values = nutrients['value'].values
+    valid = ~np.isnan(values)
+    keys = nutrients['nutrient'].cat.codes.values.astype(np.int64)[valid] * n_groups + group_codes[valid]
+    order = np.lexsort((values[valid], keys))
+    keys, values = keys[order], values[valid][order]
+
+    pairs, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    statistics = pd.DataFrame({'count': counts,
+                               'coverage': counts / np.bincount(foods['group'].cat.codes.values,
+                                                                minlength=n_groups)[pairs % n_groups].astype(float),
+                               'mean': np.add.reduceat(values, starts) / counts},
+                              columns=['count', 'coverage', 'mean'])
+    for quantile in [0.5] + list(quantiles):
+        # Interpolated between the neighbouring sorted values, as in np.percentile
+        position = starts + quantile * (counts - 1)
+        below = np.floor(position).astype(np.int64)
+        above = np.ceil(position).astype(np.int64)
+        statistics['median' if quantile == 0.5 else 'q%g' % (quantile * 100)] = \
+            values[below] + (values[above] - values[below]) * (position - below)
+    statistics.index = pd.MultiIndex.from_arrays([np.array(nutrients['nutrient'].cat.categories,
+                                                           dtype=object)[pairs // n_groups],
+                                                  group_names[pairs % n_groups]], names=['nutrient', 'group'])
+    return statistics
+
+
+def wide_nutrient_profile(profile):
+    """
+    This function lays out the statistics of nutrient_profile as a wide table, with a row for every nutrient and a
+    column for every statistic of every food group
+    :param profile: pd.DataFrame - The statistics, as returned by nutrient_profile
+    :return: pd.DataFrame - The wide table, with (food group, statistic) columns
+    """
+    return profile.unstack('group').swaplevel(axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+
+def _plot_nutrient_chart(chart):
+    """
+    This function draws the bar chart of one statistic of one nutrient for every food group, and saves it as a PNG
+    file. It runs in a worker process, and draws on the Agg canvas directly so that no display is needed
+    :param chart: tuple - The name of the nutrient, the name of the statistic, the pd.Series of the statistic for every
+    food group, and the path of the file
+    :return: str - The path of the file
+    """
+    from matplotlib.figure import Figure  # Drawn without pyplot, so that the worker processes are headless
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    nutrient, statistic, values, path = chart
+    figure = Figure(figsize=(8, 0.3 * len(values) + 1.5))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    axes.barh(np.arange(len(values)), values.values)
+    axes.set_yticks(np.arange(len(values)))
+    axes.set_yticklabels(values.index)
+    axes.set_title(u'%s of %s per Food Group' % (statistic.capitalize(), nutrient))
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+def plot_nutrient_profile(profile, directory, statistic='median', processes=None):
+    """
+    This function draws a bar chart of one statistic for every nutrient, over the food groups, in parallel worker
+    processes
+    :param profile: pd.DataFrame - The statistics, as returned by nutrient_profile
+    :param directory: The directory to save the charts to, one PNG file per nutrient
+    :param statistic: The column of the profile to plot
+    :param processes: The number of worker processes, defaults to the number of CPUs
+    :return: list - The paths of the charts
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    charts = []
+    for nutrient, values in profile[statistic].groupby(level='nutrient'):
+        file_name = ''.join(character if character.isalnum() else '_' for character in nutrient) + '.png'
+        charts.append((nutrient, statistic, values.reset_index('nutrient', drop=True),
+                       os.path.join(directory, file_name)))
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_plot_nutrient_chart, charts)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _source_fingerprint(path):
+    """
+    This function returns the fingerprint of the JSON file, which changes whenever the file is regenerated
+    :param path: The path of the JSON file
+    :return: np.ndarray - The size and the modification time of the file
+    """
+    return np.array([os.path.getsize(path), os.path.getmtime(path)], dtype=np.float64)
+
+
+class NutrientIndex(object):
+    """
+    Inverted indexes over the foods and nutrients tables, built once, that answer the questions about any nutrient or
+    food group without scanning the tables: the foods containing a nutrient, the foods of a group, the median and
+    quantiles of a nutrient in every group and the foods with the most of a nutrient. The rows of every nutrient are
+    kept sorted by value, and those of every (nutrient, food group) pair sorted by value as well, so that every query
+    only slices arrays
+    """
+    # The arrays that make up the index, stored by save
+    arrays = ['nutrient_names', 'group_names', 'food_ids', 'food_names', 'food_groups',
+              'nutrient_offsets', 'nutrient_food_ids', 'nutrient_groups', 'nutrient_values',
+              'group_value_offsets', 'group_values', 'group_offsets', 'group_food_ids']
+
+    def __init__(self, **arrays):
+        for name in self.arrays:
+            setattr(self, name, arrays[name])
+        self.nutrient_codes = dict((name, code) for code, name in enumerate(self.nutrient_names))
+        self.group_codes = dict((name, code) for code, name in enumerate(self.group_names))
+
+    @classmethod
+    def build(cls, foods, nutrients):
+        """
+        This function builds the indexes out of the foods and nutrients tables
+        :param foods: pd.DataFrame - The foods table, as returned by load_nutrients
+        :param nutrients: pd.DataFrame - The nutrients table, as returned by load_nutrients
+        :return: NutrientIndex - The index
+        """
+        nutrient_names = np.array(nutrients['nutrient'].cat.categories, dtype=np.unicode_)
+        group_names = np.array(foods['group'].cat.categories, dtype=np.unicode_)
+        n_nutrients, n_groups = len(nutrient_names), len(group_names)
+        nutrient_codes = nutrients['nutrient'].cat.codes.values.astype(np.int64)
+        # The food groups of the nutrients table may have been categorized on their own, so match them by name
+        group_codes = np.searchsorted(group_names, np.array(nutrients['group'].cat.categories, dtype=np.unicode_))
+        group_codes = group_codes[nutrients['group'].cat.codes.values]
+        food_ids = nutrients['food_id'].values
+        values = nutrients['value'].values
+
+        # Nutrient -> foods, with the most of the nutrient first, and the foods without a value last
+        order = np.lexsort((-values, nutrient_codes))
+        nutrient_offsets = np.searchsorted(nutrient_codes[order], np.arange(n_nutrients + 1))
+        nutrient_food_ids, nutrient_groups, nutrient_values = food_ids[order], group_codes[order], values[order]
+
+        # (Nutrient, food group) -> values, sorted
+        valid = ~np.isnan(values)
+        keys = nutrient_codes[valid] * n_groups + group_codes[valid]
+        order = np.lexsort((values[valid], keys))
+        group_value_offsets = np.searchsorted(keys[order], np.arange(n_nutrients * n_groups + 1))
+        group_values = values[valid][order]
+
+        # Food group -> foods
+        food_groups = foods['group'].cat.codes.values.astype(np.int64)
+        order = np.argsort(food_groups, kind='mergesort')
+        group_offsets = np.searchsorted(food_groups[order], np.arange(n_groups + 1))
+        group_food_ids = foods['id'].values[order]
+
+        # Food id -> name and group, with the food ids sorted for searching
+        order = np.argsort(foods['id'].values, kind='mergesort')
+        return cls(nutrient_names=nutrient_names, group_names=group_names, food_ids=foods['id'].values[order],
+                   food_names=np.array(foods['name'].values[order], dtype=np.unicode_),
+                   food_groups=food_groups[order], nutrient_offsets=nutrient_offsets,
+                   nutrient_food_ids=nutrient_food_ids, nutrient_groups=nutrient_groups, nutrient_values=nutrient_values,
+                   group_value_offsets=group_value_offsets, group_values=group_values, group_offsets=group_offsets,
+                   group_food_ids=group_food_ids)
+
+    def save(self, path, fingerprint):
+        """
+        This function stores the index in a .npz file
+        :param path: The path of the file
+        :param fingerprint: The fingerprint of the JSON file that the index was built from
+        :return: None
+        """
+        np.savez(path, fingerprint=fingerprint, **dict((name, getattr(self, name)) for name in self.arrays))
+
+    @classmethod
+    def load(cls, path):
+        """
+        This function loads an index stored by save
+        :param path: The path of the file
+        :return: tuple - The NutrientIndex, and the fingerprint of the JSON file that it was built from
+        """
+        with np.load(path) as stored:
+            return cls(**dict((name, stored[name]) for name in cls.arrays)), stored['fingerprint']
+
+    def _nutrient_code(self, nutrient):
+        code = self.nutrient_codes.get(nutrient)
+        if code is None:
+            raise KeyError('Nutrient %s is not in the database' % nutrient)
+        return code
+
+    def _nutrient_rows(self, nutrient):
+        code = self._nutrient_code(nutrient)
+        return slice(self.nutrient_offsets[code], self.nutrient_offsets[code + 1])
+
+    def food_names_of(self, food_ids):
+        """
+        This function looks up the names of foods
+        :param food_ids: The ids of the foods
+        :return: np.ndarray - The names of the foods
+        """
+        return self.food_names[np.searchsorted(self.food_ids, food_ids)]
+
+    def foods_containing(self, nutrient):
+        """
+        This function returns the foods in which a nutrient is present
+        :param nutrient: The name of the nutrient, for example 'Zinc, Zn'
+        :return: np.ndarray - The ids of the foods, with the most of the nutrient first
+        """
+        return self.nutrient_food_ids[self._nutrient_rows(nutrient)]
+
+    def _group_code(self, group):
+        code = self.group_codes.get(group)
+        if code is None:
+            raise KeyError('Food group %s is not in the database' % group)
+        return code
+
+    def foods_in_group(self, group):
+        """
+        This function returns the foods of a food group
+        :param group: The name of the food group, for example 'Beef Products'
+        :return: np.ndarray - The ids of the foods
+        """
+        code = self._group_code(group)
+        return self.group_food_ids[self.group_offsets[code]:self.group_offsets[code + 1]]
+
+    def _group_values(self, nutrient):
+        """
+        This function returns the sorted values of a nutrient in every food group that has it
+        :param nutrient: The name of the nutrient
+        :return: tuple - The codes of the food groups, and the sorted values of every one of them
+        """
+        code = self._nutrient_code(nutrient)
+        n_groups = len(self.group_names)
+        offsets = self.group_value_offsets[code * n_groups:(code + 1) * n_groups + 1]
+        groups = np.flatnonzero(np.diff(offsets))
+        return groups, [self.group_values[offsets[group]:offsets[group + 1]] for group in groups]
+
+    def group_quantiles(self, nutrient, quantiles=(0.25, 0.5, 0.75)):
+        """
+        This function returns quantiles of the content of a nutrient in the foods of every food group
+        :param nutrient: The name of the nutrient
+        :param quantiles: The quantiles, between 0 and 1
+        :return: pd.DataFrame - The quantiles (columns) for every food group that has the nutrient (rows)
+        """
+        groups, group_values = self._group_values(nutrient)
+        table = np.empty((len(groups), len(quantiles)))
+        for row, values in enumerate(group_values):
+            # The values are sorted, so the quantiles are interpolated between neighbours as in np.percentile
+            table[row] = np.interp(np.asarray(quantiles) * (len(values) - 1), np.arange(len(values)), values)
+        return pd.DataFrame(table, index=self.group_names[groups], columns=list(quantiles))
+
+    def group_median(self, nutrient):
+        """
+        This function returns the median content of a nutrient in the foods of every food group
+        :param nutrient: The name of the nutrient
+        :return: pd.Series - The median for every food group that has the nutrient, sorted by the food group
+        """
+        groups, group_values = self._group_values(nutrient)
+        medians = [(values[(len(values) - 1) // 2] + values[len(values) // 2]) / 2.0 for values in group_values]
+        return pd.Series(medians, index=self.group_names[groups])
+
+    def top_foods(self, nutrient, k=10, group=None):
+        """
+        This function returns the foods with the most of a nutrient
+        :param nutrient: The name of the nutrient
+        :param k: The number of foods
+        :param group: The name of a food group to only return its foods, or None for all the foods
+        :return: np.recarray - The id, name, group and value of the foods, with the most of the nutrient first. It is
+        a record array rather than a DataFrame to keep the query fast, pd.DataFrame(...) converts it
+        """
+        rows = self._nutrient_rows(nutrient)
+        if group is not None:
+            code = self._group_code(group)
+            selected = rows.start + np.flatnonzero(self.nutrient_groups[rows] == code)[:k]
+        else:
+            selected = np.arange(rows.start, min(rows.start + k, rows.stop))
+        food_ids = self.nutrient_food_ids[selected]
+        return np.rec.fromarrays([food_ids, self.food_names_of(food_ids),
+                                  self.group_names[self.nutrient_groups[selected]], self.nutrient_values[selected]],
+                                 names=['id', 'name', 'group', 'value'])
+
+
+def load_nutrient_index(path=NUTRIENTS_JSON, rebuild=False):
+    """
+    This function returns the NutrientIndex of the JSON file of nutrient-db. The index is stored next to the JSON
+    file, and is rebuilt when the size or the modification time of the JSON file changes
+    :param path: The path of the JSON file written by nutrientdb.py -e
+    :param rebuild: Whether to build the index even if the stored one is up to date
+    :return: NutrientIndex - The index
+    """
+    index_path = os.path.splitext(path)[0] + '.index.npz'
+    fingerprint = _source_fingerprint(path)
+    if not rebuild and os.path.exists(index_path):
+        index, stored_fingerprint = NutrientIndex.load(index_path)
+        if np.array_equal(stored_fingerprint, fingerprint):
+            return index
+
+    index = NutrientIndex.build(*load_nutrients(path))
+    index.save(index_path, fingerprint)
+    return index
+
+
+class IncrementalAnalysis(object):
+    """
+    The amino acid table and the median content of a nutrient per food group, kept up to date as the JSON file of
+    nutrient-db is regenerated. Every food record is fingerprinted by the hash of its line, and its contribution to the
+    partial aggregates (the foods of every amino acid, the values of the nutrient in every food group) is stored with
+    it. An update only hashes the unchanged records, and parses and aggregates only the added, changed and removed ones.
+    The position of every record in the file is kept as well, so that the foods are listed in the order of the database.
+    amino_acid_foods and median_by_group over the flat tables are the reference results, which the aggregates match
+    """
+
+    def __init__(self, amino_acids=None, nutrient=ZINC):
+        self.amino_acids = list(amino_acids or AMINO_ACIDS)
+        self.nutrient = nutrient
+        # Hash of the record -> (food id, food name, food group, value of the nutrient, amino acids present)
+        self.records = {}
+        # Hash of the record -> position of the record in the file
+        self.positions = {}
+        # Amino acid -> food name -> hashes of the records of the foods of that name
+        self.amino_foods = dict((amino_acid, {}) for amino_acid in self.amino_acids)
+        # Food group -> hash of the record -> value of the nutrient
+        self.group_values = {}
+        # Food group -> median of the nutrient, for the groups that have not changed since it was calculated
+        self.group_medians = {}
+        # Fingerprint of the JSON file that the aggregates are up to date with
+        self.fingerprint = None
+
+    def _add(self, digest, food):
+        food_id, name, group = int(food['id']), food['name']['long'], food.get('group') or u''
+        value, amino_acids = None, []
+        for nutrient in food.get('nutrients') or []:
+            if nutrient['name'] == self.nutrient and value is None and nutrient.get('value') is not None:
+                value = float(nutrient['value'])
+            elif nutrient['name'] in self.amino_foods:
+                amino_acids.append(nutrient['name'])
+        self.records[digest] = (food_id, name, group, value, amino_acids)
+        for amino_acid in amino_acids:
+            self.amino_foods[amino_acid].setdefault(name, set()).add(digest)
+        if value is not None:
+            self.group_values.setdefault(group, {})[digest] = value
+            self.group_medians.pop(group, None)
+
+    def _remove(self, digest):
+        food_id, name, group, value, amino_acids = self.records.pop(digest)
+        for amino_acid in amino_acids:
+            digests = self.amino_foods[amino_acid][name]
+            digests.discard(digest)
+            if not digests:
+                del self.amino_foods[amino_acid][name]
+        if value is not None:
+            del self.group_values[group][digest]
+            if not self.group_values[group]:
+                del self.group_values[group]
+            self.group_medians.pop(group, None)
+
+    def update(self, path=NUTRIENTS_JSON):
+        """
+        This function brings the aggregates up to date with the JSON file
+        :param path: The path of the JSON file written by nutrientdb.py -e
+        :return: tuple - The number of records added and removed, a changed record counting as both
+        """
+        positions, added = {}, []
+        with io.open(path, 'rb') as json_file:
+            for line in json_file:
+                line = line.strip()
+                if not line:
+                    continue
+                digest = hashlib.sha1(line).hexdigest()
+                if digest in positions:
+                    continue
+                positions[digest] = len(positions)
+                if digest not in self.records:
+                    added.append((digest, line))
+        self.positions = positions
+        removed = [digest for digest in self.records if digest not in positions]
+        for digest in removed:
+            self._remove(digest)
+        for digest, line in added:
+            self._add(digest, json.loads(line.decode('utf-8')))
+        return len(added), len(removed)
+
+    def amino_acid_foods(self):
+        """
+        This function returns the foods in which every amino acid is present, the same as amino_acid_foods
+        :return: pd.DataFrame - Table with a column for every amino acid, listing the names of its foods in the order of
+        the database, padded with None below its last food
+        """
+        positions = self.positions
+        columns = dict((amino_acid, pd.Series(sorted(foods, key=lambda name: min(positions[digest]
+                                                                                for digest in foods[name]))))
+                       for amino_acid, foods in self.amino_foods.items())
+        table = pd.DataFrame(columns).reindex(columns=self.amino_acids)
+        return table.where(table.notnull(), None)
+
+    def median_by_group(self):
+        """
+        This function returns the median content of the nutrient in the foods of every food group, the same as
+        median_by_group. Only the medians of the food groups that changed are recalculated
+        :return: pd.Series - The median for every food group that has the nutrient, sorted by the food group
+        """
+        for group, values in self.group_values.items():
+            if group not in self.group_medians:
+                self.group_medians[group] = np.median(list(values.values()))
+        return pd.Series(self.group_medians).sort_index()
+
+    def save(self, path):
+        """
+        This function stores the aggregates in a file
+        :param path: The path of the file
+        :return: None
+        """
+        with open(path, 'wb') as state_file:
+            cPickle.dump(self.__dict__, state_file, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """
+        This function loads the aggregates stored by save
+        :param path: The path of the file
+        :return: IncrementalAnalysis - The aggregates
+        """
+        analysis = cls.__new__(cls)
+        with open(path, 'rb') as state_file:
+            analysis.__dict__.update(cPickle.load(state_file))
+        return analysis
+
+
+def update_incremental_analysis(path=NUTRIENTS_JSON, amino_acids=None, nutrient=ZINC):
+    """
+    This function returns the IncrementalAnalysis of the JSON file of nutrient-db. The aggregates are stored next to
+    the JSON file, and every run only processes the records that changed since the last one. The records are not even
+    hashed when the size and the modification time of the JSON file have not changed
+    :param path: The path of the JSON file written by nutrientdb.py -e
+    :param amino_acids: The names of the amino acids, defaults to AMINO_ACIDS
+    :param nutrient: The name of the nutrient to calculate the medians of
+    :return: IncrementalAnalysis - The aggregates, up to date with the JSON file
+    """
+    state_path = os.path.splitext(path)[0] + '.analysis.pkl'
+    analysis = None
+    if os.path.exists(state_path):
+        analysis = IncrementalAnalysis.load(state_path)
+        if analysis.amino_acids != list(amino_acids or AMINO_ACIDS) or analysis.nutrient != nutrient:
+            analysis = None
+    if analysis is None:
+        analysis = IncrementalAnalysis(amino_acids, nutrient)
+    fingerprint = _source_fingerprint(path)
+    if np.array_equal(analysis.fingerprint, fingerprint):
+        return analysis
+    added, removed = analysis.update(path)
+    logging.info('%d food records added and %d removed since the last run' % (added, removed))
+    analysis.fingerprint = fingerprint
+    analysis.save(state_path)
+    return analysis
+
+
+def print_progress(parsed, size):
+    """
+    This function prints how much of the JSON file has been parsed, for use as the progress hook of load_nutrients
+    :param parsed: The number of bytes parsed
+    :param size: The size of the file in bytes
+    :return: None
+    """
+    print('Parsed %.1f MB out of %.1f MB' % (parsed / 1e6, size / 1e6))
+
 
 def main():
     """
@@ -36,71 +702,42 @@ def main():
     """
     # Wrap in a try block so that we catch any exceptions thrown by other functions and return a 1 for graceful exit
     try:
-        # ===== Step 1: Load the JSON dataset into Pandas dataframe =====
-        # Load the DataFrame
-        # NOTE: The default json method is called as an underlyer by read_json.
-        raw_dataframe = pd.read_json(os.path.join('nutrient-db', 'nutrients.json'), lines=True)
+        # ===== Step 1: Load the JSON dataset =====
+        # Only the food records that changed since the last run are parsed and aggregated. The results are the same as
+        # amino_acid_foods and median_by_group over the flat tables of the --profile steps
+        analysis = update_incremental_analysis(NUTRIENTS_JSON, AMINO_ACIDS, ZINC)
 
         # ===== Step 2: Output Amino Acid and Food Group Table =====
-        # List of Amino Acids - From Wikipedia (https://en.wikipedia.org/wiki/Amino_acid#Table_of_standard_amino_acid_abbreviations_and_properties)
-        amino_dict = {
-            "Alanine": [],
-            "Arginine": [],
-            "Asparagine": [],
-            "Aspartic acid": [],
-            "Cysteine": [],
-            "Glutamic acid": [],
-            "Glutamine": [],
-            "Glycine": [],
-            "Histidine": [],
-            "Isoleucine": [],
-            "Leucine": [],
-            "Lysine": [],
-            "Methionine": [],
-            "Phenylalanine": [],
-            "Proline": [],
-            "Serine": [],
-            "Threonine": [],
-            "Tryptophan": [],
-            "Tyrosine": [],
-            "Valine": [],
-        }
-        amino_list = amino_dict.keys()
-        # Create List of Food Groups
-        for index in xrange(0, len(raw_dataframe)):
-            food_item = raw_dataframe.iloc[index]['name']['long']
-            if index % 1000 == 0:
-                print('Processing Item between %s and %s out of %s' % (str(index), str(index + 1000), str(len(raw_dataframe))))
-            for n_index in xrange(0,len(raw_dataframe.iloc[index]['nutrients'])):
-                if raw_dataframe.iloc[index]['nutrients'][n_index]['name'] in amino_list:
-                    if food_item in amino_dict[raw_dataframe.iloc[index]['nutrients'][n_index]['name']]:
-                        continue
-                    else:
-                        amino_dict[raw_dataframe.iloc[index]['nutrients'][n_index]['name']].append(food_item)
-
-        amino_dataframe = pd.DataFrame.from_dict(amino_dict, orient='index').transpose()
+        amino_dataframe = analysis.amino_acid_foods()
         print(amino_dataframe.head())
         print(amino_dataframe.tail())
-        amino_dataframe.to_csv(os.path.join(os.getcwd(), 'amino_dataframe.csv'), index=False)
+        amino_dataframe.to_csv(os.path.join(os.getcwd(), 'amino_dataframe.csv'), index=False, encoding='utf-8')
 
         # ===== Step 3: Output Bar Chart for Median of Zinc Content =====
-        # Initialize an empty dictionary of unique 'group' elements, with key as group and value as a list
-        group_dict = {key: [] for key in raw_dataframe['group'].unique()}
-        group_list = group_dict.keys()
-
-        for index in xrange(0, len(raw_dataframe)):
-            group_item = raw_dataframe.iloc[index]['group']
-            if index % 1000 == 0:
-                print('Processing Item between %s and %s out of %s' % (str(index), str(index + 1000), str(len(raw_dataframe))))
-            for n_index in xrange(0, len(raw_dataframe.iloc[index]['nutrients'])):
-                if raw_dataframe.iloc[index]['nutrients'][n_index]['name'] == u'Zinc, Zn':
-                    group_dict[group_item].append(raw_dataframe.iloc[index]['nutrients'][n_index]['value'])
-                    break
-
-        zinc_dataframe = pd.DataFrame(dict([(k, pd.Series(v)) for k, v in group_dict.items()]))
-        sns.barplot(data=zinc_dataframe, orient='h', ci=None)
+        zinc_medians = analysis.median_by_group()
+        sns.barplot(x=zinc_medians.values, y=zinc_medians.index, orient='h', ci=None)
         sns.plt.show()
 
+        # The steps below work on the whole database, and reparse it whenever it is regenerated, so they only run
+        # when asked for
+        charts = '--charts' in sys.argv[1:]
+        if charts or '--profile' in sys.argv[1:]:
+            # ===== Additional Step: Load the foods and their nutrients as flat tables =====
+            # Parsed from the JSON file only when it is regenerated
+            foods, nutrients = load_nutrients(NUTRIENTS_JSON, progress=print_progress)
+
+            # ===== Additional Step: Query the Zinc content through the nutrient index =====
+            # The index answers the same questions for any nutrient or food group, without scanning the tables
+            nutrient_index = load_nutrient_index(NUTRIENTS_JSON)
+            print(pd.DataFrame(nutrient_index.top_foods(ZINC, 10)))
+            print(nutrient_index.group_quantiles(ZINC))
+
+            # ===== Additional Step: Profile every nutrient in every food group =====
+            profile = nutrient_profile(foods, nutrients)
+            wide_nutrient_profile(profile).to_csv(os.path.join(os.getcwd(), 'nutrient_profile.csv'), encoding='utf-8')
+            if charts:
+                plot_nutrient_profile(profile, os.path.join(os.getcwd(), 'nutrient_profile'))
+
     except BaseException, e:
         # Casting a wide net to catch all exceptions
         print('\n%s' % str(e))
@@ -0,0 +1,126 @@
+"""
+@author: Osama Iqbal
+
+Code uses Python 2.7, packaged with Anaconda 4.4.0
+
+Tests of Mini Project 3: the incremental analysis and the nutrient index give the same amino acid table and Zinc
+medians as amino_acid_foods and median_by_group over the flat tables, which are the reference implementation.
+
+Usage: python -m unittest discover -s MP3
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import os  # For the paths of the test files
+import io  # For writing the JSON file
+import json  # For writing the food records
+import random  # For generating the food records
+import shutil  # For removing the test files
+import tempfile  # For a directory for the test files
+import unittest  # The test framework
+import numpy as np  # For comparing the medians
+
+import OsamaIqbal_MiniProject3 as mp3  # The analysis of Mini Project 3
+
+GROUPS = [u'Beef Products', u'Pork Products', u'Dairy and Egg Products', u'Fish', u'Soups, Sauces, and Gravies']
+
+
+def food_record(food_id, random_state):
+    """
+    This function generates a food record like the ones of nutrientdb.py -e
+    :param food_id: The id of the food
+    :param random_state: random.Random - The random number generator
+    :return: dict - The food record
+    """
+    nutrients = [{'name': name, 'units': 'mg', 'group': 'Elements', 'value': round(random_state.expovariate(1.0), 3)}
+                 for name in [mp3.ZINC, u'Iron, Fe'] if random_state.random() < 0.8]
+    nutrients += [{'name': name, 'units': 'g', 'group': 'Amino Acids', 'value': round(random_state.random(), 3)}
+                  for name in mp3.AMINO_ACIDS[:5] if random_state.random() < 0.5]
+    # Some foods share their name, to check that they are listed once
+    return {'id': food_id, 'name': {'long': u'Food %d caf\xe9' % (food_id % 40), 'common': [], 'sci': ''},
+            'group': random_state.choice(GROUPS), 'manufacturer': '', 'nutrients': nutrients, 'portions': []}
+
+
+class IncrementalAnalysisTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'nutrients.json')
+        self.random_state = random.Random(0)
+        self.records = [food_record(food_id, self.random_state) for food_id in range(1000, 1100)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_records(self):
+        with io.open(self.path, 'w', encoding='utf-8') as json_file:
+            for record in self.records:
+                json_file.write(json.dumps(record, ensure_ascii=False) + u'\n')
+
+    def assert_same_analysis(self, analysis):
+        foods, nutrients = mp3.parse_nutrients_json(self.path)
+        expected = mp3.amino_acid_foods(foods, nutrients)
+        self.assertTrue(expected.fillna('').equals(analysis.amino_acid_foods().fillna('')))
+        expected = mp3.median_by_group(nutrients)
+        medians = analysis.median_by_group()
+        self.assertEqual(list(expected.index), list(medians.index))
+        np.testing.assert_allclose(medians.values, expected.values)
+
+    def test_first_update(self):
+        self.write_records()
+        analysis = mp3.IncrementalAnalysis()
+        self.assertEqual(analysis.update(self.path), (100, 0))
+        self.assert_same_analysis(analysis)
+
+    def test_changed_records(self):
+        self.write_records()
+        analysis = mp3.IncrementalAnalysis()
+        analysis.update(self.path)
+        # Change, remove, add and move records
+        self.records[3] = food_record(1003, self.random_state)
+        del self.records[10:15]
+        self.records.insert(0, food_record(2000, self.random_state))
+        self.records = self.records[50:] + self.records[:50]
+        self.write_records()
+        added, removed = analysis.update(self.path)
+        self.assertEqual((added, removed), (2, 6))
+        self.assert_same_analysis(analysis)
+
+    def test_update_incremental_analysis(self):
+        self.write_records()
+        analysis = mp3.update_incremental_analysis(self.path)
+        self.assert_same_analysis(mp3.update_incremental_analysis(self.path))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'nutrients.analysis.pkl')))
+        self.assertEqual(analysis.fingerprint.tolist(), mp3._source_fingerprint(self.path).tolist())
+
+
+class NutrientProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        random_state = random.Random(1)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'nutrients.json')
+        with io.open(self.path, 'w', encoding='utf-8') as json_file:
+            for food_id in range(1000, 1200):
+                json_file.write(json.dumps(food_record(food_id, random_state), ensure_ascii=False) + u'\n')
+        self.foods, self.nutrients = mp3.parse_nutrients_json(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_profile_median(self):
+        expected = mp3.median_by_group(self.nutrients)
+        profile = mp3.nutrient_profile(self.foods, self.nutrients)
+        np.testing.assert_allclose(profile.loc[mp3.ZINC, 'median'].reindex(expected.index).values, expected.values)
+
+    def test_index_median(self):
+        expected = mp3.median_by_group(self.nutrients)
+        medians = mp3.NutrientIndex.build(self.foods, self.nutrients).group_median(mp3.ZINC)
+        np.testing.assert_allclose(medians.reindex(expected.index).values, expected.values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,9 +23,12 @@ __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
 import sys  # For exiting gracefully
-import quandl  # For fetching the Market Data
+import os  # For locating the shared market data module
+import datetime  # For fetching the data up to today
 import pandas as pd  # For fetching the data in a DataFrame
 import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import market_data  # Shared market data providers, in the root of the repository
 
 
 def plot_group_bar_chart(plotting_dataframe):
@@ -94,10 +97,14 @@ def main():
         presidents_dataframe['End'] = pd.to_datetime(presidents_dataframe['End'])
 
         # ===== Step 2: Download the two Indices =====
-        # By using the collapse parameter, we directly get yearly data instead fetching daily/monthly
-        # data and performing calculations on that dataset
-        djia_dataframe = quandl.get("BCB/UDJIAD1", collapse='annual')
-        snp_dataframe = quandl.get("MULTPL/SP500_REAL_PRICE_MONTH", collapse='annual')
+        # The data comes from Quandl unless another provider is chosen, and is collapsed to the value at the
+        # end of every year, instead of performing calculations on the daily/monthly dataset
+        provider = market_data.get_provider(default='quandl')
+        today = datetime.datetime.now().date()
+        djia_dataframe = market_data.get_history("BCB/UDJIAD1", '1900-01-01', today,
+                                                 provider=provider).resample('A').last()
+        snp_dataframe = market_data.get_history("MULTPL/SP500_REAL_PRICE_MONTH", '1900-01-01', today,
+                                                provider=provider).resample('A').last()
 
         # Filter so that they are 1920 onwards
         djia_dataframe = djia_dataframe.loc['1920':]
@@ -107,8 +114,8 @@ def main():
         # Since our data is already in yearly format, we need to call pct_change() with 1 as the
         # parameter. Assuming our data would have been daily or monthly, then we would have called
         # pct_change(252) for yearly returns from daily, and pct_change(21) for yearly returns from monthly data
-        djia_yearly_returns = djia_dataframe['Value'].pct_change(1)
-        snp_yearly_returns = snp_dataframe['Value'].pct_change(1)
+        djia_yearly_returns = djia_dataframe['Close'].pct_change(1)
+        snp_yearly_returns = snp_dataframe['Close'].pct_change(1)
         # Join the DataFrames
         djia_dataframe = djia_dataframe.join(djia_yearly_returns, rsuffix='_Yearly_Returns')
         snp_dataframe = snp_dataframe.join(snp_yearly_returns, rsuffix='_Yearly_Returns')
@@ -129,8 +136,8 @@ def main():
         snp_dataframe = snp_dataframe.join(pd.DataFrame(presidency_list, columns=['Party']).set_index(
             snp_dataframe.index))
         # Combine SnP and DJIA frame
-        combined_dataframe = pd.DataFrame({'DJIA': djia_dataframe['Value_Yearly_Returns'],
-                                           'SNP': snp_dataframe['Value_Yearly_Returns'],
+        combined_dataframe = pd.DataFrame({'DJIA': djia_dataframe['Close_Yearly_Returns'],
+                                           'SNP': snp_dataframe['Close_Yearly_Returns'],
                                            'Party': snp_dataframe['Party']}).reset_index(drop=True)
 
         democrats_dataframe = combined_dataframe[combined_dataframe['Party'] == 'Democratic']
@@ -0,0 +1,498 @@
+"""
+@author: Osama Iqbal
+
+Code uses Python 2.7, packaged with Anaconda 4.4.0
+
+Shared market data layer for the Mini Projects and the Final Project.
+
+The data comes from a data provider: Yahoo Finance, Quandl, local Parquet or CSV files, CSV files served over HTTP,
+or synthetic data generated on the fly. The provider defaults to Yahoo Finance (Quandl for Mini Project 4), and can be
+changed with the MARKET_DATA_PROVIDER environment variable, set to yahoo, quandl, synthetic, parquet:<directory>,
+csv:<directory> or http:<url template>, where the url template contains {ticker}, {start} and {end}.
+The synthetic provider generates realistic, deterministic OHLCV series of any size, so that the analytics can be run
+and benchmarked without a network connection.
+
+End of day data from the network providers is cached on disk, one columnar (Parquet) file per ticker, along with the
+date range that has been fetched for it. Later runs only fetch the dates that are missing from the cache, and in
+offline mode the data is served purely from the cache.
+
+The cache directory defaults to ~/.market_data_cache, and can be changed with the MARKET_DATA_CACHE environment
+variable. Setting MARKET_DATA_OFFLINE=1 turns on offline mode.
+
+Many tickers can be downloaded at the same time with get_histories, which shares a token bucket rate limit between the
+downloads and retries the transient failures with an exponential backoff.
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os  # For the paths of the cache files
+import errno  # For telling apart the errors of creating the cache directory
+import re  # For turning tickers into file names
+import json  # For storing the date range covered by the cache
+import time  # For rate limiting and backing off requests
+import zlib  # For deterministic per ticker seeds of the synthetic data
+import random  # For jittering the retries of failed requests
+import threading  # For sharing the rate limit between download threads
+import socket  # For telling apart the network errors that are worth retrying
+import warnings  # For removing Deprecation Warning w.r.t. Yahoo Finance Fix
+from multiprocessing.pool import ThreadPool  # For downloading many tickers at once
+from StringIO import StringIO  # For parsing CSV responses
+from urllib import quote  # For putting tickers in URLs
+import numpy as np  # For generating synthetic data
+import pandas as pd  # For reading and writing the cached data
+
+CACHE_DIRECTORY = os.environ.get('MARKET_DATA_CACHE', os.path.join(os.path.expanduser('~'), '.market_data_cache'))
+OFFLINE = os.environ.get('MARKET_DATA_OFFLINE', '') == '1'
+PROVIDER = os.environ.get('MARKET_DATA_PROVIDER')
+
+
+def fetch_from_yahoo_finance(ticker, start, end):
+    """
+    This function fetches data from Yahoo Finance in the form of a Pandas DataFrame
+    :param ticker: The Ticker symbol for which data needs to be fetched
+    :param start: The first date to fetch
+    :param end: The last date to fetch
+    :return: pd.DataFrame - Returns a DataFrame containing the data fetched from Yahoo Finance
+    """
+    # Only needed when going to the network, so that offline runs do not need the Yahoo Finance packages
+    from pandas_datareader import data as pdr
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
+    # Fix Pandas Datareader's Issues with Yahoo Finance (Since yahoo abandoned it's API)
+    pdr_override()
+    return pdr.get_data_yahoo(ticker, start=str(start.date()), end=str(end.date()), auto_adjust=True)
+
+
+class DataProvider(object):
+    """
+    Base class of the sources of end of day data. A provider is called with a ticker and the first and last dates,
+    and returns a DataFrame indexed by date with (at least) a Close column
+    """
+    # The name of the provider, used for its directory in the cache
+    name = None
+    # Whether the data is fetched over the network, and so is worth caching
+    cached = False
+
+    def get_history(self, ticker, start, end):
+        """
+        This function returns the end of day data of a ticker between two dates
+        :param ticker: The Ticker symbol
+        :param start: The first date, as a pd.Timestamp
+        :param end: The last date, as a pd.Timestamp
+        :return: pd.DataFrame - The data between the two dates
+        """
+        raise NotImplementedError
+
+    def __call__(self, ticker, start, end):
+        return self.get_history(ticker, pd.Timestamp(start), pd.Timestamp(end))
+
+
+class YahooProvider(DataProvider):
+    """
+    Provider of end of day data from Yahoo Finance
+    """
+    name = 'yahoo'
+    cached = True
+
+    def get_history(self, ticker, start, end):
+        return fetch_from_yahoo_finance(ticker, start, end)
+
+
+class QuandlProvider(DataProvider):
+    """
+    Provider of end of day data from Quandl. The tickers are Quandl codes, for example BCB/UDJIAD1. A dataset with a
+    single Value column is returned with it as the Close column, like the other providers
+    """
+    name = 'quandl'
+    cached = True
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def get_history(self, ticker, start, end):
+        import quandl  # Only needed by this provider
+        data = quandl.get(ticker, start_date=str(start.date()), end_date=str(end.date()), api_key=self.api_key)
+        return data.rename(columns={'Value': 'Close'})
+
+
+class FileProvider(DataProvider):
+    """
+    Provider of end of day data from local Parquet or CSV files, one file per ticker named after it, for example
+    data/^GSPC.csv. Parquet files have the dates in a Date column, CSV files in their first column
+    """
+    name = 'file'
+
+    def __init__(self, directory, file_format='parquet'):
+        if file_format not in ('parquet', 'csv'):
+            raise ValueError('File format %s is not parquet or csv.' % file_format)
+        self.directory = directory
+        self.file_format = file_format
+
+    def get_history(self, ticker, start, end):
+        path = os.path.join(self.directory, ticker + '.' + self.file_format)
+        if self.file_format == 'parquet':
+            data = pd.read_parquet(path).set_index('Date')
+        else:
+            data = pd.read_csv(path, index_col=0, parse_dates=True)
+        return data.sort_index().loc[start:end]
+
+
+class HttpCsvProvider(DataProvider):
+    """
+    Provider of end of day data served as CSV over HTTP, for example by a local mirror or a mock server. The URL
+    template has {ticker}, {start} and {end} fields. Requests go through a single session, so that connections to the
+    server are pooled and reused across requests and threads
+    """
+    name = 'http'
+    cached = True
+
+    def __init__(self, url_template, pool_size=10):
+        import requests  # Only needed by this provider
+        self.url_template = url_template
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_history(self, ticker, start, end):
+        response = self.session.get(self.url_template.format(ticker=quote(ticker), start=start.date(),
+                                                             end=end.date()))
+        response.raise_for_status()
+        return pd.read_csv(StringIO(response.text), index_col=0, parse_dates=True)
+
+
+class SyntheticProvider(DataProvider):
+    """
+    Provider of synthetic end of day data. Every ticker gets its own geometric Brownian motion path of business days
+    from the origin date, seeded by the ticker, so the same ticker always gives the same data: the random numbers are
+    drawn day by day, so the data of a date does not depend on the range requested. The open, high and low prices and
+    the volume are drawn around the close prices. Like a ticker listed on the origin date, there is no data before it
+    """
+    name = 'synthetic'
+
+    def __init__(self, seed=0, origin='1990-01-01', initial_price=100.0, mu=0.07, sigma=0.20, volume=1e6):
+        self.seed = seed
+        self.origin = pd.Timestamp(origin)
+        self.initial_price = initial_price
+        self.mu = mu
+        self.sigma = sigma
+        self.volume = volume
+
+    def simulate(self, ticker, n_days):
+        """
+        This function simulates the first days of the data of a ticker
+        :param ticker: The Ticker symbol
+        :param n_days: The number of business days from the origin
+        :return: dict - Arrays of the Open, High, Low and Close prices and the Volume
+        """
+        random_state = np.random.RandomState([self.seed, zlib.crc32(ticker.encode('utf-8')) & 0xffffffff])
+        daily_sigma = self.sigma / np.sqrt(252)
+        # One row of shocks per day, so that the first days are the same for any n_days
+        shocks = random_state.standard_normal((n_days, 4)).T
+        log_returns = self.mu / 252 - 0.5 * daily_sigma ** 2 + daily_sigma * shocks[0]
+        close = self.initial_price * np.exp(np.cumsum(log_returns))
+        # The open gaps away from the previous close, and the high and low reach beyond the open and the close
+        previous_close = np.concatenate(([self.initial_price], close[:-1]))
+        open_price = previous_close * np.exp(0.25 * daily_sigma * shocks[1])
+        # Volume is lognormal, and higher on days with large moves
+        return {'Open': open_price,
+                'High': np.maximum(open_price, close) * np.exp(0.5 * daily_sigma * np.abs(shocks[2])),
+                'Low': np.minimum(open_price, close) * np.exp(-0.5 * daily_sigma * np.abs(shocks[3])),
+                'Close': close,
+                'Volume': np.round(self.volume * np.exp(0.25 * shocks[2] + 0.1 * np.abs(shocks[0])))}
+
+    def get_history(self, ticker, start, end):
+        dates = pd.bdate_range(self.origin, end)
+        data = pd.DataFrame(self.simulate(ticker, len(dates)), index=dates,
+                            columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+        data.index.name = 'Date'
+        return data.loc[max(start, self.origin):end]
+
+
+def get_provider(name=None, default='yahoo'):
+    """
+    This function returns a data provider by its name
+    :param name: yahoo, quandl, synthetic, parquet:<directory>, csv:<directory> or http:<url template>. Defaults to
+    the MARKET_DATA_PROVIDER environment variable, or else the default
+    :param default: The name of the provider to use when neither the name nor the environment variable are set
+    :return: DataProvider - The data provider
+    """
+    name = name or PROVIDER or default
+    kind, _, location = name.partition(':')
+    if kind == 'yahoo':
+        return YahooProvider()
+    elif kind == 'quandl':
+        return QuandlProvider()
+    elif kind == 'synthetic':
+        return SyntheticProvider()
+    elif kind in ('parquet', 'csv'):
+        return FileProvider(location, file_format=kind)
+    elif kind == 'http':
+        return HttpCsvProvider(location)
+    raise ValueError('Unknown data provider %s. Valid values are yahoo, quandl, synthetic, parquet:<directory>, '
+                     'csv:<directory>, http:<url template>.' % name)
+
+
+def synthetic_close_prices(n_tickers, n_days, seed=0, end='2017-10-01'):
+    """
+    This function generates the close prices of many synthetic tickers, for offline benchmarks of the analytics
+    :param n_tickers: The number of tickers
+    :param n_days: The number of business days
+    :param seed: Seed of the synthetic data
+    :param end: The last date
+    :return: pd.DataFrame - The close prices, with a column per ticker
+    """
+    dates = pd.bdate_range(end=end, periods=n_days)
+    provider = SyntheticProvider(seed=seed, origin=dates[0])
+    tickers = ['SYN%05d' % index for index in range(n_tickers)]
+    close = np.empty((n_days, n_tickers))
+    for index, ticker in enumerate(tickers):
+        close[:, index] = provider.simulate(ticker, n_days)['Close']
+    return pd.DataFrame(close, index=dates, columns=tickers)
+
+
+def _cache_paths(ticker, cache_directory):
+    """
+    This function returns the paths of the data file and the coverage file of a ticker in the cache
+    :param ticker: The Ticker symbol
+    :param cache_directory: The directory of the cache
+    :return: tuple - The path of the data file and the path of the coverage file
+    """
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', ticker)
+    return (os.path.join(cache_directory, name + '.parquet'),
+            os.path.join(cache_directory, name + '.json'))
+
+
+def read_cache(ticker, cache_directory=None):
+    """
+    This function reads the cached data of a ticker
+    :param ticker: The Ticker symbol
+    :param cache_directory: The directory of the cache, defaults to CACHE_DIRECTORY
+    :return: tuple - The cached DataFrame and the (start, end) dates it covers, or (None, None) if not cached
+    """
+    data_path, coverage_path = _cache_paths(ticker, cache_directory or CACHE_DIRECTORY)
+    if not (os.path.exists(data_path) and os.path.exists(coverage_path)):
+        return None, None
+    with open(coverage_path) as coverage_file:
+        coverage = json.load(coverage_file)
+    data = pd.read_parquet(data_path).set_index('Date')
+    return data, (pd.Timestamp(coverage['start']), pd.Timestamp(coverage['end']))
+
+
+def write_cache(ticker, data, coverage, cache_directory=None):
+    """
+    This function writes the data of a ticker to the cache
+    :param ticker: The Ticker symbol
+    :param data: The DataFrame to cache, indexed by date
+    :param coverage: The (start, end) dates covered by the data
+    :param cache_directory: The directory of the cache, defaults to CACHE_DIRECTORY
+    :return: None
+    """
+    cache_directory = cache_directory or CACHE_DIRECTORY
+    try:
+        os.makedirs(cache_directory)
+    except OSError, e:
+        # The directory may exist already, or have just been created by another download thread
+        if e.errno != errno.EEXIST:
+            raise
+    data_path, coverage_path = _cache_paths(ticker, cache_directory)
+    data = data.copy()
+    data.index.name = 'Date'
+    data.reset_index().to_parquet(data_path)
+    with open(coverage_path, 'w') as coverage_file:
+        json.dump({'start': str(coverage[0].date()), 'end': str(coverage[1].date())}, coverage_file)
+
+
+def get_history(ticker, start, end, provider=None, cache_directory=None, offline=None):
+    """
+    This function returns the end of day data of a ticker between two dates. For providers that fetch over the
+    network, only the dates that are not in the cache yet are fetched, and the cache is updated with them
+    :param ticker: The Ticker symbol for which data needs to be fetched
+    :param start: The first date
+    :param end: The last date
+    :param provider: The DataProvider to fetch the data from, defaults to get_provider()
+    :param cache_directory: The directory of the cache, defaults to CACHE_DIRECTORY
+    :param offline: Whether to only serve data from the cache, defaults to OFFLINE
+    :return: pd.DataFrame - Returns a DataFrame containing the data between the two dates
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    provider = provider or get_provider()
+    if not provider.cached:
+        return provider(ticker, start, end)
+    # Every provider has its own directory in the cache
+    cache_directory = os.path.join(cache_directory or CACHE_DIRECTORY, provider.name)
+    offline = OFFLINE if offline is None else offline
+    cached, coverage = read_cache(ticker, cache_directory)
+
+    if offline:
+        if cached is None:
+            raise IOError('No cached data found for Ticker %s, and running offline' % ticker)
+        if start < coverage[0] or end > coverage[1]:
+            logging.warning('Cached data for Ticker %s only covers %s to %s' % (ticker, coverage[0].date(),
+                                                                                coverage[1].date()))
+        return cached.loc[start:end]
+
+    if cached is None:
+        logging.info('Fetching %s from %s to %s' % (ticker, start.date(), end.date()))
+        cached = provider(ticker, start, end)
+        coverage = (start, end)
+    else:
+        missing = []
+        if start < coverage[0]:
+            missing.append((start, coverage[0]))
+        if end > coverage[1]:
+            # Fetch the last cached day again, since it may have been fetched before the market closed
+            missing.append((coverage[1], end))
+        if not missing:
+            return cached.loc[start:end]
+        for missing_start, missing_end in missing:
+            logging.info('Fetching %s from %s to %s' % (ticker, missing_start.date(), missing_end.date()))
+            cached = pd.concat([cached, provider(ticker, missing_start, missing_end)])
+        # Newly fetched rows replace the cached ones for the same date
+        cached = cached[~cached.index.duplicated(keep='last')].sort_index()
+        coverage = (min(start, coverage[0]), max(end, coverage[1]))
+
+    if not cached.empty:
+        write_cache(ticker, cached, coverage, cache_directory)
+    return cached.loc[start:end]
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, shared between threads. Tokens are added at a steady rate up to the capacity of the
+    bucket, and every request takes a token, waiting for one if the bucket is empty
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: The number of tokens added per second
+        :param capacity: The largest number of tokens in the bucket, that is, the largest burst of requests
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        This function takes a token from the bucket, waiting until one is available
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_transient_error(error):
+    """
+    This function tells whether a failed request is worth retrying: network errors and timeouts, server errors and
+    rate limiting (HTTP 5xx and 429), and the errors pandas_datareader raises when it cannot read from the data source.
+    Anything else, like an unknown ticker, another HTTP 4xx, a missing package or a bug, fails the same way every time
+    :param error: The exception raised by the request
+    :return: bool - Whether the request may succeed when sent again
+    """
+    if isinstance(error, socket.error):
+        return True
+    try:
+        import requests  # Only installed along with the providers that use it
+    except ImportError:
+        pass
+    else:
+        if isinstance(error, requests.HTTPError):
+            status = error.response.status_code if error.response is not None else None
+            return status is not None and (status >= 500 or status == 429)
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+    try:
+        from pandas_datareader._utils import RemoteDataError  # Only installed along with the Yahoo Finance provider
+    except ImportError:
+        return False
+    return isinstance(error, RemoteDataError)
+
+
+class RetryingProvider(DataProvider):
+    """
+    Provider that wraps another one, taking a token from a rate limiter before every request, and retrying requests
+    that fail transiently (see is_transient_error) with exponential backoff. Data providers like Yahoo Finance
+    sometimes bug out, and succeed when asked again a little later, while other errors are raised straight away. They
+    also bug out by returning no data, so empty data is retried as well, but only over a
+    range of at least EMPTY_RETRY_DAYS business days: shorter ranges, like the refresh of the cache over a weekend or
+    a holiday, are legitimately empty
+    """
+    # No market is closed for two weeks, so empty data over that many business days is a failure
+    EMPTY_RETRY_DAYS = 10
+
+    def __init__(self, provider, rate_limiter=None, retries=3, backoff=1.0):
+        """
+        :param provider: The DataProvider to wrap
+        :param rate_limiter: TokenBucket shared by the requests, or None to not limit the rate
+        :param retries: The number of times a request is retried
+        :param backoff: The wait before the first retry in seconds, doubling on every further retry
+        """
+        self.provider = provider
+        self.name = provider.name
+        self.cached = provider.cached
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+
+    def get_history(self, ticker, start, end):
+        retry_empty = len(pd.bdate_range(start, end)) >= self.EMPTY_RETRY_DAYS
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                data = self.provider(ticker, start, end)
+                if not data.empty or not retry_empty or attempt == self.retries:
+                    return data
+                logging.info('No Data found for Ticker %s, retrying' % ticker)
+            except Exception, e:
+                if attempt == self.retries or not is_transient_error(e):
+                    raise
+                logging.info('Fetching Ticker %s failed (%s), retrying' % (ticker, e))
+            # Jitter the wait, so that threads that failed together do not retry together
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def get_histories(tickers, start, end, provider=None, max_workers=4, rate=2.0, burst=2, retries=3, backoff=1.0,
+                  cache_directory=None, offline=None):
+    """
+    This function returns the end of day data of many tickers between two dates, downloading them at the same time
+    on a pool of threads, under a shared token bucket rate limit, and retrying transient failures with backoff. Like
+    get_history, only the dates that are not in the cache yet are fetched
+    :param tickers: The Ticker symbols for which data needs to be fetched
+    :param start: The first date
+    :param end: The last date
+    :param provider: The DataProvider to fetch the data from, defaults to get_provider()
+    :param max_workers: The number of tickers downloaded at the same time
+    :param rate: The largest number of requests per second, on average
+    :param burst: The largest number of requests sent at once
+    :param retries: The number of times a failed request is retried
+    :param backoff: The wait before the first retry in seconds, doubling on every further retry
+    :param cache_directory: The directory of the cache, defaults to CACHE_DIRECTORY
+    :param offline: Whether to only serve data from the cache, defaults to OFFLINE
+    :return: dict - Mapping of the tickers to DataFrames containing their data between the two dates
+    """
+    provider = RetryingProvider(provider or get_provider(), TokenBucket(rate, burst), retries, backoff)
+    pool = ThreadPool(max(1, min(max_workers, len(tickers))))
+    try:
+        histories = pool.map(lambda ticker: get_history(ticker, start, end, provider, cache_directory, offline),
+                             tickers)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(tickers, histories))